@@ -8,8 +8,9 @@
 
       This class allows one to define CSP variables.
 
-      Currently no support for backtracking--i.e., can not
-      remember and undo changes.
+      Backtracking is supported through a Trail (see C below): if the
+      variable is attached to a trail, every change to its current
+      domain is recorded and can be undone.
 
       On initialization the variable object can be given a name, and
       an original domain of values. This list of domain values can be
@@ -19,7 +20,9 @@
       To support its CSP propagation, the class also maintains a
       current domain for the variable. Values pruned from the variable
       domain are removed from the current domain but not from the
-      original domain.
+      original domain. The current domain is stored as an integer
+      bitset over positions in the original domain, so membership
+      tests, prunings and size queries are constant time.
 
       The current domain can be re-initialized at any point to be
       equal to the original domain.
@@ -39,32 +42,127 @@
       for each variable in the constraint (in the same ORDER as the
       variables of the constraint were specified).
 
+      Subclasses provide other representations with the same interface
+      (has_support and revise, used by enforce_gac): AllDiffConstraint
+      (no tuples, supports found by bipartite matching),
+      CompactTableConstraint (tuples stored once, supports tracked with
+      bitsets), and the intensional NotEqualConstraint and
+      PredicateConstraint (no tuples, a revise function of their own).
+
+    C) class Trail
+
+      This class allows one to remember and undo changes to variable
+      domains (and to any other reversible state, e.g., data kept by a
+      constraint), in support of backtracking search.
+
+      A trail is a stack of (object, saved state) entries divided into
+      levels. push_level() opens a new level (a checkpoint), and
+      pop_level() or restore_level() undo, in reverse order, every
+      change recorded since the matching checkpoint. Undoing costs
+      O(number of changes), not O(size of the CSP). An object records
+      a change by calling trail.record(self, state) BEFORE modifying
+      itself, and must implement restore_state(state).
+
+    D) class Profile
+
+      This class collects statistics on the work done by propagation:
+      counters of constraint revisions, support checks, tuple validity
+      checks, prunings, queue pushes and domain wipe outs, time spent in
+      each phase (e.g., model construction versus propagation), and
+      optional callbacks fired on each pruning and each revision.
+
+      Collection is off unless a profile is active (see Profile); the
+      instrumented routines then only test that PROFILE is None.
+
+    E) class Budget
+
+      This class bounds the work of propagation and search: a deadline,
+      a maximum number of constraint revisions and of search nodes, and
+      a cancellation flag that another thread can set. Routines given a
+      budget stop when it runs out, leaving the domains pruned so far
+      (which still contain every solution), and the budget records that
+      their result is incomplete.
+
     '''
 
-class Variable:
+import time
+
+#The active Profile, if any (see class Profile)
+PROFILE = None
+
+class Variable(object):
     '''Class for defining CSP variables'''
+
+    #The original domain is kept as a list (values need not be numbers and
+    #their order is significant). The current domain is an integer bitset
+    #over positions in that list: bit j is set iff dom[j] is still in the
+    #current domain. This gives O(1) membership, pruning and size queries.
+    __slots__ = ('name', 'dom', 'trail', '_index', '_curbits', '_cursize')
+
     def __init__(self, name, domain=[]):
         '''Create a variable object, specifying its name (a
         string). Optionally specify the initial domain.
         '''
         self.name = name                #text name for variable
-        self.dom = list(domain)         #Make a copy of passed domain
-        self.curdom = list(domain)      #using list
+        self.dom = []                   #original domain, as a list
+        self._index = {}                #value -> position in dom
+        self._curbits = 0               #current domain, as a bitset
+        self._cursize = 0               #number of bits set in _curbits
+        self.trail = None               #Trail recording domain changes, if any
+        self.add_domain_values(domain)
 
     def add_domain_values(self, values):
         '''Incrementally add domain values to the domain (for
            incrementally specifying the domain)'''
-        for val in values: self.dom.append(val)
-        for val in values: self.curdom.append(val)
+        for val in values:
+            if val in self._index:
+                continue
+            j = len(self.dom)
+            self._index[val] = j
+            self.dom.append(val)
+            self._curbits |= 1 << j
+            self._cursize += 1
 
     def value_index(self, value):
         '''Domain values need not be numbers, so return the index
            in the domain list of a variable value'''
-        return self.dom.index(value)
+        try:
+            return self._index[value]
+        except KeyError:
+            raise ValueError("{} is not in the domain of {}".format(value, self.name))
 
     def prune_value(self, value):
         '''Remove value from current domain'''
-        self.curdom.remove(value)
+        bit = 1 << self.value_index(value)
+        if not self._curbits & bit:
+            raise ValueError("{} is not in the current domain of {}".format(value, self.name))
+        if self.trail is not None:
+            self.trail.record(self, (self._curbits, self._cursize))
+        self._curbits ^= bit
+        self._cursize -= 1
+        if PROFILE is not None:
+            PROFILE.pruned(self, value)
+
+    def assign(self, value):
+        '''Reduce the current domain to value (e.g., to set a pre-set
+           cell or make a search decision). This is not counted as a
+           pruning'''
+        bit = 1 << self.value_index(value)
+        if self.trail is not None:
+            self.trail.record(self, (self._curbits, self._cursize))
+        self._curbits = bit
+        self._cursize = 1
+
+    def restore_curdom(self):
+        '''Re-initialize the current domain to the original domain'''
+        if self.trail is not None:
+            self.trail.record(self, (self._curbits, self._cursize))
+        self._curbits = (1 << len(self.dom)) - 1
+        self._cursize = len(self.dom)
+
+    def restore_state(self, state):
+        '''Undo a change recorded on the trail'''
+        self._curbits, self._cursize = state
 
     def domain_size(self):
         '''Return the size of the domain'''
@@ -75,19 +173,32 @@ class Variable:
         return(self.dom)
 
     def cur_domain(self):
-        '''return the variable current domain'''
-        return(self.curdom)
+        '''return the variable current domain (a new list, in the same
+           order as the original domain)'''
+        dom = self.dom
+        vals = []
+        bits = self._curbits
+        while bits:
+            low = bits & -bits
+            vals.append(dom[low.bit_length() - 1])
+            bits ^= low
+        return(vals)
+
+    def cur_domain_bits(self):
+        '''return the current domain as a bitset over value indices'''
+        return(self._curbits)
 
     def cur_domain_size(self):
         '''Return the size of the current domain'''
-        return(len(self.curdom))
+        return(self._cursize)
 
     def in_cur_domain(self, value):
         '''check if value is in current domain'''
-        return(value in self.curdom)
+        j = self._index.get(value)
+        return(j is not None and (self._curbits >> j) & 1 == 1)
 
     def print_var(self):
-        print "Variable\"{}\": Dom = {}, CurDom = {}".format(self.name, self.dom, self.curdom)
+        print "Variable\"{}\": Dom = {}, CurDom = {}".format(self.name, self.dom, self.cur_domain())
 
 
 
@@ -100,7 +211,12 @@ class Constraint:
        [v1, v2, v3], where each vi is a variable object then a
        satisfying tuple will have to be a list of three values. For
        example, the tuple [1, 2, 1] would specify the assignments
-       v1=1, v2=2, v3=1---the ordering has to agree with the scope.'''
+       v1=1, v2=2, v3=1---the ordering has to agree with the scope.
+
+       Subclasses that keep reversible state of their own can record it
+       on self.trail (if not None) and implement restore_state.'''
+
+    trail = None
 
     def __init__(self, name, scope):
         '''create a constraint object, specify the constraint name (a
@@ -120,8 +236,14 @@ class Constraint:
         #for solving real CSP problems better data structures
         #would be required.
         self.sup_tuples = []
+        #residues[i][j] is the position in sup_tuples[i][j] of the last
+        #support found for that variable value pair (AC-3rm). It is only
+        #a hint of where to look first, so it stays correct if values are
+        #later restored to the variable domains.
+        self.residues = []
         for i in range(len(self.scope)): #i-th variable
             self.sup_tuples.append([])
+            self.residues.append([0] * self.scope[i].domain_size())
             for j in range(self.scope[i].domain_size()): #j-th value
                 self.sup_tuples[i].append([])
 
@@ -141,6 +263,8 @@ class Constraint:
         '''internal routine to test if a tuple contains values that are
            in the current domain of the variables. The constraint scope
            determines what variable each value in the tuple corresponds to'''
+        if PROFILE is not None:
+            PROFILE.tuple_checks += 1
         i = 0
         for val in t:
              var = self.scope[i]
@@ -152,17 +276,57 @@ class Constraint:
     def has_support(self, var, val):
         i = self.scope.index(var)
         j = var.value_index(val)
-        #it would be more efficient to work through the list of supporting tuples
-        #from the end, poping tuples as they are found to be invalid. 
-        #this way we would avoid processing the same invalid tuple twice.
-        #However, if eventually we add support for backtracking (i.e., restoring
-        #tuples to validity) this would make it more complex. So for now 
-        #just do it the more time consuming but easier way.
-        for t in self.sup_tuples[i][j]:
-            if self.tuple_is_valid(t):
+        #first re-check the residual support found by the previous call,
+        #then resume the scan after it, wrapping around to the start. No
+        #tuple is ever discarded, so restoring values (e.g., when
+        #backtracking) never invalidates this.
+        sups = self.sup_tuples[i][j]
+        n = len(sups)
+        if n == 0:
+            return False
+        r = self.residues[i][j]
+        if self.tuple_is_valid(sups[r]):
+            return True
+        for k in xrange(r + 1, n):
+            if self.tuple_is_valid(sups[k]):
+                self.residues[i][j] = k
+                return True
+        for k in xrange(0, r):
+            if self.tuple_is_valid(sups[k]):
+                self.residues[i][j] = k
                 return True
         return False
 
+    def revise(self):
+        '''Prune the values of the variables in scope that have no
+           support, until every remaining value has one (a pruning can
+           remove the support of values already checked, so the scope is
+           swept again after any change). Return the list of variables
+           whose domain changed; this stops early at a domain wipe out,
+           which the caller detects from the domain size of the returned
+           variables.
+
+           Subclasses that can prune more directly than by calling
+           has_support on every value override this.'''
+        pruned = []
+        changed = True
+        while changed:
+            changed = False
+            for var in self.scope:
+                if PROFILE is not None:
+                    PROFILE.support_checks += var.cur_domain_size()
+                for val in var.cur_domain():
+                    if not self.has_support(var, val):
+                        #prune this domain value of the variable,
+                        #since it cannot lead to a solution
+                        var.prune_value(val)
+                        changed = True
+                        if var not in pruned:
+                            pruned.append(var)
+                        if var.cur_domain_size() == 0:
+                            return pruned
+        return pruned
+
     def print_constraint(self):
         '''print basic information about the constraint'''
         print "Constraint {}: scope = {}".format(self.name,
@@ -182,3 +346,647 @@ class Constraint:
                                              val,
                                              self.sup_tuples[self.scope.index(var)][var.value_index(val)])
 
+
+
+class AllDiffConstraint(Constraint):
+    '''Class for defining all-different constraints without enumerating
+       their satisfying tuples. Supports are computed Regin-style: a
+       maximum matching between the scope variables and their current
+       domain values is found, and a value is supported iff its edge
+       belongs to some maximum matching covering all of the variables.
+       That is the case iff the edge is in the matching, lies on an
+       alternating cycle (its two ends are in the same strongly
+       connected component of the oriented value graph), or lies on an
+       alternating path starting at a free value.
+
+       The result is the same as for a table constraint holding every
+       permutation of distinct values, and can be used by enforce_gac in
+       place of such a table constraint.'''
+
+    def __init__(self, name, scope):
+        '''create an all-different constraint object, specify the
+        constraint name (a string) and its scope (an ORDERED list of
+        variable objects).'''
+
+        self.scope = list(scope)
+        self.name = name
+        self.sat_tuples = []
+        self._pos = dict((var, i) for i, var in enumerate(self.scope))
+        self._match = [None] * len(self.scope) #var position -> value
+        self._supported = None #var position -> bitset of supported values
+        self._signature = None #current domain bitsets _supported is valid for
+
+    def add_satisfying_tuples(self, tuples):
+        '''The satisfying tuples of an all-different constraint are
+           implicit and cannot be added explicitly'''
+        raise TypeError("AllDiffConstraint {} has implicit satisfying tuples".format(self.name))
+
+    def tuple_is_valid(self, t):
+        '''test if a tuple contains pairwise distinct values that are in
+           the current domain of the variables'''
+        if len(set(t)) != len(t):
+            return False
+        for var, val in zip(self.scope, t):
+            if not var.in_cur_domain(val):
+                return False
+        return True
+
+    def has_support(self, var, val):
+        i = self._pos[var]
+        self._refresh()
+        return (self._supported[i] >> var.value_index(val)) & 1 == 1
+
+    def revise(self):
+        '''Prune every unsupported value at once: removing unsupported
+           values leaves the supports of the others unchanged'''
+        self._refresh()
+        pruned = []
+        for var, sup in zip(self.scope, self._supported):
+            if PROFILE is not None:
+                PROFILE.support_checks += var.cur_domain_size()
+            if var.cur_domain_bits() & ~sup:
+                for val in var.cur_domain():
+                    if not (sup >> var.value_index(val)) & 1:
+                        var.prune_value(val)
+                pruned.append(var)
+                if var.cur_domain_size() == 0:
+                    break
+        return pruned
+
+    def _refresh(self):
+        '''recompute the supported values if the current domains changed
+           in a way that could invalidate them'''
+        signature = [var.cur_domain_bits() for var in self.scope]
+        if signature == self._signature:
+            return
+        if self._supported is not None:
+            #Removing only unsupported values cannot change which of the
+            #remaining values are supported, so the cached result is kept
+            #as long as every supported value is still present and no
+            #value has been restored (e.g., by backtracking).
+            for bits, old, sup in zip(signature, self._signature, self._supported):
+                if bits & sup != sup or bits & ~old:
+                    break
+            else:
+                self._signature = signature
+                return
+        self._signature = signature
+        self._supported = self._compute_supports()
+
+    def _compute_supports(self):
+        '''return, for each variable of the scope, the bitset of its
+           current domain values that have a support'''
+        n = len(self.scope)
+        doms = [var.cur_domain() for var in self.scope]
+
+        #value -> var position matched to it, repairing the previous matching
+        owner = {}
+        match = self._match
+        for i in range(n):
+            if match[i] is not None and (match[i] in owner or
+                                         not self.scope[i].in_cur_domain(match[i])):
+                match[i] = None
+            if match[i] is not None:
+                owner[match[i]] = i
+        for i in range(n):
+            if match[i] is None and not self._augment(i, doms, match, owner, set()):
+                #no matching covers all variables: nothing is supported
+                return [0] * n
+
+        #Orient the value graph: matched edges var -> value, other edges
+        #value -> var. Variables are nodes 0..n-1, values are keyed by value.
+        succ = {}
+        for i in range(n):
+            succ[i] = [('val', match[i])]
+            for val in doms[i]:
+                if val != match[i]:
+                    succ.setdefault(('val', val), []).append(i)
+        for val in owner:
+            succ.setdefault(('val', val), [])
+
+        #Values reachable from a free value by an alternating path
+        free = [('val', val) for i in range(n) for val in doms[i] if val not in owner]
+        reached = set(free)
+        stack = list(reached)
+        while stack:
+            node = stack.pop()
+            for nxt in succ[node]:
+                if nxt not in reached:
+                    reached.add(nxt)
+                    stack.append(nxt)
+
+        comp = _strongly_connected_components(succ)
+
+        supported = []
+        for i in range(n):
+            var = self.scope[i]
+            bits = 0
+            for val in doms[i]:
+                node = ('val', val)
+                if val == match[i] or node in reached or comp[node] == comp[i]:
+                    bits |= 1 << var.value_index(val)
+            supported.append(bits)
+        return supported
+
+    def _augment(self, i, doms, match, owner, visited):
+        '''find an augmenting path from the unmatched variable at
+           position i (Kuhn's algorithm)'''
+        for val in doms[i]:
+            if val in visited:
+                continue
+            visited.add(val)
+            j = owner.get(val)
+            if j is None or self._augment(j, doms, match, owner, visited):
+                match[i] = val
+                owner[val] = i
+                return True
+        return False
+
+    def print_constraint_all(self):
+        '''print all of the information about the constraint'''
+        self.print_constraint()
+        for var in self.scope:
+            print "  {}: {}".format(var.name,
+                                    [val for val in var.cur_domain() if self.has_support(var, val)])
+
+
+def _strongly_connected_components(succ):
+    '''Given a directed graph as a dict mapping each node to its list of
+       successors, return a dict mapping each node to the id of its
+       strongly connected component (iterative Tarjan)'''
+    index = {}
+    low = {}
+    comp = {}
+    onstack = set()
+    stack = []
+    counter = 0
+    ncomp = 0
+    for root in succ:
+        if root in index:
+            continue
+        work = [(root, iter(succ[root]))]
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        onstack.add(root)
+        while work:
+            node, it = work[-1]
+            advanced = False
+            for nxt in it:
+                if nxt not in index:
+                    index[nxt] = low[nxt] = counter
+                    counter += 1
+                    stack.append(nxt)
+                    onstack.add(nxt)
+                    work.append((nxt, iter(succ[nxt])))
+                    advanced = True
+                    break
+                elif nxt in onstack:
+                    low[node] = min(low[node], index[nxt])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:
+                while True:
+                    w = stack.pop()
+                    onstack.discard(w)
+                    comp[w] = ncomp
+                    if w == node:
+                        break
+                ncomp += 1
+    return comp
+
+
+class NotEqualConstraint(Constraint):
+    '''Class for defining binary not-equal constraints intensionally,
+       i.e., without listing their satisfying tuples. A value of one
+       variable has a support unless the other variable has that value as
+       its only value, so the constraint is revised in constant time.'''
+
+    def __init__(self, name, scope):
+        '''create a not-equal constraint object, specify the constraint
+        name (a string) and its scope (a list of two variable objects)'''
+
+        if len(scope) != 2:
+            raise ValueError("NotEqualConstraint {} needs a scope of two variables".format(name))
+        self.scope = list(scope)
+        self.name = name
+        self.sat_tuples = []
+
+    def add_satisfying_tuples(self, tuples):
+        '''The satisfying tuples of a not-equal constraint are implicit
+           and cannot be added explicitly'''
+        raise TypeError("NotEqualConstraint {} has implicit satisfying tuples".format(self.name))
+
+    def tuple_is_valid(self, t):
+        '''test if a tuple contains two different values that are in the
+           current domain of the variables'''
+        return (t[0] != t[1] and self.scope[0].in_cur_domain(t[0])
+                and self.scope[1].in_cur_domain(t[1]))
+
+    def has_support(self, var, val):
+        other = self.scope[1] if var is self.scope[0] else self.scope[0]
+        return other.cur_domain_size() > 1 or not other.in_cur_domain(val)
+
+    def revise(self):
+        '''If one variable has a single value, prune it from the other'''
+        x, y = self.scope
+        pruned = []
+        if x.cur_domain_size() == 1:
+            val = x.cur_domain()[0]
+            if y.in_cur_domain(val):
+                y.prune_value(val)
+                pruned.append(y)
+        #y may only now have a single value
+        if y.cur_domain_size() == 1:
+            val = y.cur_domain()[0]
+            if x.in_cur_domain(val):
+                x.prune_value(val)
+                pruned.append(x)
+        return pruned
+
+    def print_constraint_all(self):
+        '''print all of the information about the constraint'''
+        self.print_constraint()
+        for var in self.scope:
+            print "  {}: {}".format(var.name, var.cur_domain())
+
+
+class PredicateConstraint(Constraint):
+    '''Class for defining constraints intensionally, by a predicate over
+       the values of the variables in scope: predicate(v1, ..., vk)
+       returns True iff the assignment satisfies the constraint.
+
+       By default a value is checked for support by enumerating the
+       combinations of values of the other variables (which is only
+       practical for small scopes). A revise function can be given to
+       prune the domains directly instead: called with the constraint, it
+       must prune unsupported values and return the list of variables
+       whose domain changed, as Constraint.revise does.'''
+
+    def __init__(self, name, scope, predicate, revise=None):
+        '''create a constraint object, specify the constraint name (a
+        string), its scope (an ORDERED list of variable objects), the
+        predicate over values of the scope, and optionally the revise
+        function'''
+
+        self.scope = list(scope)
+        self.name = name
+        self.sat_tuples = []
+        self.predicate = predicate
+        self.revise_function = revise
+
+    def add_satisfying_tuples(self, tuples):
+        '''The satisfying tuples of a predicate constraint are implicit
+           and cannot be added explicitly'''
+        raise TypeError("PredicateConstraint {} has implicit satisfying tuples".format(self.name))
+
+    def tuple_is_valid(self, t):
+        '''test if a tuple satisfies the predicate and contains values that
+           are in the current domain of the variables'''
+        for var, val in zip(self.scope, t):
+            if not var.in_cur_domain(val):
+                return False
+        return bool(self.predicate(*t))
+
+    def has_support(self, var, val):
+        i = self.scope.index(var)
+        doms = [v.cur_domain() for v in self.scope]
+        doms[i] = [val]
+        return self._extend([], doms)
+
+    def _extend(self, values, doms):
+        '''depth first search for values of the remaining variables that
+           satisfy the predicate'''
+        if len(values) == len(doms):
+            return bool(self.predicate(*values))
+        for val in doms[len(values)]:
+            if self._extend(values + [val], doms):
+                return True
+        return False
+
+    def revise(self):
+        if self.revise_function is not None:
+            return self.revise_function(self)
+        return Constraint.revise(self)
+
+    def print_constraint_all(self):
+        '''print all of the information about the constraint'''
+        self.print_constraint()
+        for var in self.scope:
+            print "  {}: {}".format(var.name,
+                                    [val for val in var.cur_domain() if self.has_support(var, val)])
+
+
+class CompactTableConstraint(Constraint):
+    '''Class for defining constraints specified by tables of satisfying
+       tuples, using Compact-Table style bitsets instead of lists of
+       supporting tuples.
+
+       Each tuple is stored once, and numbered by its position in
+       sat_tuples. For each variable value pair the constraint keeps the
+       set of tuples containing it as an integer bitset (bit k set iff
+       tuple k contains the value). The tuples that are still valid with
+       respect to the current domains are kept in a further bitset, which
+       is updated incrementally from the values pruned since the last
+       update, so a value has a support iff its bitset intersects the
+       valid tuples.
+
+       The valid tuples are reversible state: if the constraint is
+       attached to a Trail (by setting its trail attribute, e.g. with
+       Trail.attach) their previous value is recorded before each update
+       and restored on backtracking. Without a trail, values restored to
+       the domains are detected and the valid tuples are recomputed.'''
+
+    def __init__(self, name, scope):
+        '''create a table constraint object, specify the constraint name
+        (a string) and its scope (an ORDERED list of variable
+        objects). The satisfying tuples are specified later using
+        add_satisfying_tuples'''
+
+        self.scope = list(scope)
+        self.name = name
+        self.sat_tuples = []
+        self._pos = dict((var, i) for i, var in enumerate(self.scope))
+        #supports[i][j] is the bitset of tuples with value j (by index in
+        #the domain) for the i-th variable
+        self.supports = [[0] * var.domain_size() for var in self.scope]
+        self._valid = 0             #bitset of tuples valid with current domains
+        self._seen = None           #domain bitsets _valid was computed for
+
+    def add_satisfying_tuples(self, tuples):
+        '''Add list of satisfying tuple to the constraint (for incremental
+           specification'''
+        for t in tuples:
+            bit = 1 << len(self.sat_tuples)
+            self.sat_tuples.append(t)
+            for i, val in enumerate(t):
+                j = self.scope[i].value_index(val)
+                self.supports[i][j] |= bit
+        #the new tuples may be valid: recompute from scratch on next use
+        self._seen = None
+
+    def has_support(self, var, val):
+        i = self._pos[var]
+        self._update()
+        return self._valid & self.supports[i][var.value_index(val)] != 0
+
+    def valid_tuples(self):
+        '''return the list of satisfying tuples that are valid with
+           respect to the current domains'''
+        self._update()
+        return [t for k, t in enumerate(self.sat_tuples) if (self._valid >> k) & 1]
+
+    def restore_state(self, state):
+        '''Undo an update recorded on the trail'''
+        self._valid, self._seen = state
+
+    def _update(self):
+        '''bring the valid tuples up to date with the current domains'''
+        doms = [var.cur_domain_bits() for var in self.scope]
+        if doms == self._seen:
+            return
+        if self.trail is not None:
+            self.trail.record(self, (self._valid, self._seen))
+
+        if self._seen is None or any(bits & ~old for bits, old in zip(doms, self._seen)):
+            #first use, or a value was restored to a domain (which can make
+            #tuples valid again): start from all of the tuples
+            seen = [None] * len(doms)
+            valid = (1 << len(self.sat_tuples)) - 1
+        else:
+            seen = self._seen
+            valid = self._valid
+
+        for i in range(len(doms)):
+            bits = doms[i]
+            old = seen[i]
+            if bits == old:
+                continue
+            sups = self.supports[i]
+            if old is None or _popcount(old & ~bits) > _popcount(bits):
+                #keep the tuples supporting one of the current values
+                mask = 0
+                for j in _bit_positions(bits):
+                    mask |= sups[j]
+                valid &= mask
+            else:
+                #drop the tuples supporting one of the removed values
+                for j in _bit_positions(old & ~bits):
+                    valid &= ~sups[j]
+
+        self._valid = valid
+        self._seen = doms
+
+    def print_constraint_all(self):
+        '''print all of the information about the constraint'''
+        self.print_constraint()
+        print "Satisfying Tuples:"
+        for t in self.sat_tuples:
+            print "{}: {}".format(t, self.tuple_is_valid(t))
+
+
+def _popcount(bits):
+    '''Return the number of bits set in a non-negative integer'''
+    return bin(bits).count('1')
+
+def _bit_positions(bits):
+    '''Yield the positions of the bits set in a non-negative integer'''
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class Trail(object):
+    '''Class for recording changes to variables (and other reversible
+       objects) so that they can be undone when backtracking'''
+
+    def __init__(self, variables=[]):
+        '''Create an empty trail. Optionally attach it to a list of
+        variables'''
+        self.entries = []               #(object, saved state) pairs
+        self.marks = []                 #len(entries) at each push_level
+        self.attach(variables)
+
+    def attach(self, variables):
+        '''Record the domain changes of each of the variables on this
+           trail'''
+        for var in variables:
+            var.trail = self
+
+    def level(self):
+        '''Return the current level (the number of open checkpoints)'''
+        return(len(self.marks))
+
+    def push_level(self):
+        '''Open a new checkpoint and return its level'''
+        self.marks.append(len(self.entries))
+        return(len(self.marks))
+
+    def record(self, obj, state):
+        '''Remember the state of obj before it is modified. Changes made
+           while no checkpoint is open can never be undone, so they are
+           not recorded'''
+        if self.marks:
+            self.entries.append((obj, state))
+
+    def pop_level(self):
+        '''Undo every change made since the last push_level, and close
+           that checkpoint'''
+        mark = self.marks.pop()
+        entries = self.entries
+        while len(entries) > mark:
+            obj, state = entries.pop()
+            obj.restore_state(state)
+
+    def restore_level(self, level):
+        '''Undo changes until the trail is back to the given level
+           (as returned by level() or push_level())'''
+        while len(self.marks) > level:
+            self.pop_level()
+
+
+class Profile(object):
+    '''Class for collecting propagation statistics. A profile is active
+       while it is used as a context manager:
+
+           with Profile() as p:
+               sudoku_enforce_gac_model_1(board)
+           print p.counters()
+
+       on_prune(var, value) is called after each pruning, and
+       on_revise(constraint, pruned) after each revision of a constraint
+       by enforce_gac (pruned is the list of variables it pruned).
+
+       tuple_checks counts the tuples tested by table constraints only:
+       the all-different and not-equal constraints test no tuples (their
+       work is counted as support_checks).'''
+
+    COUNTERS = ('revisions', 'support_checks', 'tuple_checks', 'prunings',
+                'queue_pushes', 'wipeouts')
+
+    def __init__(self, on_prune=None, on_revise=None):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        self.times = {}                 #phase name -> seconds
+        self.on_prune = on_prune
+        self.on_revise = on_revise
+        self._previous = None
+
+    def __enter__(self):
+        global PROFILE
+        self._previous = PROFILE
+        PROFILE = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global PROFILE
+        PROFILE = self._previous
+        return False
+
+    def pruned(self, var, value):
+        '''record the pruning of value from var'''
+        self.prunings += 1
+        if self.on_prune is not None:
+            self.on_prune(var, value)
+
+    def revised(self, constraint, pruned):
+        '''record a revision of constraint that pruned the variables
+           in pruned'''
+        self.revisions += 1
+        if self.on_revise is not None:
+            self.on_revise(constraint, pruned)
+
+    def timer(self, phase):
+        '''return a context manager adding the time spent in it to the
+           given phase'''
+        return _PhaseTimer(self, phase)
+
+    def counters(self):
+        '''return the counters and phase times as a dictionary'''
+        result = dict((name, getattr(self, name)) for name in self.COUNTERS)
+        result['times'] = dict(self.times)
+        return result
+
+
+class _PhaseTimer(object):
+    def __init__(self, profile, phase):
+        self.profile = profile
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        times = self.profile.times
+        times[self.phase] = times.get(self.phase, 0.0) + time.time() - self.start
+        return False
+
+
+class _NoTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NO_TIMER = _NoTimer()
+
+def profile_phase(phase):
+    '''Return a context manager timing the given phase in the active
+       profile (doing nothing if there is none)'''
+    if PROFILE is None:
+        return _NO_TIMER
+    return PROFILE.timer(phase)
+
+
+class Budget(object):
+    '''Class for bounding the work of propagation and search. seconds is
+       the time allowed from now, revisions and nodes the numbers of
+       constraint revisions and search nodes allowed (None for no limit).
+
+           budget = Budget(seconds=0.005)
+           domains = sudoku_enforce_gac_model_2(board, budget)
+           if budget.exhausted: ...      #domains only partly pruned
+
+       cancel() (e.g., from another thread) makes the budget run out at
+       the next check. A budget is spent by every call it is given to.'''
+
+    def __init__(self, seconds=None, revisions=None, nodes=None):
+        self.deadline = None if seconds is None else time.time() + seconds
+        self.max_revisions = revisions
+        self.max_nodes = nodes
+        self.revisions = 0
+        self.nodes = 0
+        self.cancelled = False
+        self.exhausted = False          #True once the budget has run out
+
+    def cancel(self):
+        '''Make the budget run out'''
+        self.cancelled = True
+
+    def revised(self):
+        '''Spend one revision. Return True if the budget has run out'''
+        self.revisions += 1
+        if self.max_revisions is not None and self.revisions > self.max_revisions:
+            self.exhausted = True
+        return self.check()
+
+    def node(self):
+        '''Spend one search node. Return True if the budget has run out'''
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            self.exhausted = True
+        return self.check()
+
+    def check(self):
+        '''Return True if the budget has run out (or was cancelled)'''
+        if not self.exhausted:
+            if self.cancelled or (self.deadline is not None and time.time() >= self.deadline):
+                self.exhausted = True
+        return self.exhausted
@@ -0,0 +1,188 @@
+'''Batch processing of many sudoku boards.
+
+   Boards are read in the common one-line format: 81 characters giving
+   the cells row by row, with 0 or . for an empty cell, e.g.
+
+   002090060040001008070420003500000300001060500003000006100057040600900020020080100
+
+   Larger boards use the same format, with one character per cell (256
+   for 16x16 boards, 625 for 25x25 boards); values above 9 are written
+   as letters, A for 10, B for 11, and so on.
+
+   enforce_gac_many and solve_many take any iterable of boards (lists of
+   lists, as for sudoku_enforce_gac_model_1) and return an iterator over
+   the results, in the same order as the boards. The boards are sent in
+   chunks to a pool of worker processes, each of which keeps its own
+   CompiledModel; only a bounded number of chunks is in flight at any
+   time, so the input can be a stream of any length.
+
+   Given a cspbase.Budget, each chunk is processed with a copy of it,
+   taken when the chunk is sent: its deadline applies to the whole call,
+   cancel() to the chunks sent after it, and its revision and node limits
+   to each chunk (with processes=1 the budget itself is spent by every
+   board). Boards processed once it has run out are only partly pruned
+   (solve sets stats['incomplete']).
+
+   Run as a script to process a file of boards (or standard input):
+
+   python sudoku_batch.py [--model 1|2] [--solve] [--ordering mrv|domwdeg]
+                          [--processes N] [--chunksize N] [FILE]
+'''
+
+from sudoku_search import *
+from collections import deque
+import argparse
+import json
+import multiprocessing
+import sys
+
+
+#cell characters, by value (0 is an empty cell)
+CELL_CHARS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+def parse_board(line):
+    '''Given a line of n**4 cell characters (see CELL_CHARS, with 0 or .
+    for an empty cell; whitespace is ignored), return the board as a list
+    of n*n lists'''
+
+    cells = [c for c in line if not c.isspace()]
+    size = int(round(len(cells) ** 0.25)) ** 2
+    if size == 0 or size * size != len(cells) or size >= len(CELL_CHARS):
+        raise ValueError("a board needs n**4 cells, got {}".format(len(cells)))
+
+    board = []
+    for i in range(size):
+        row = []
+        for c in cells[size * i:size * i + size]:
+            value = 0 if c == '.' else CELL_CHARS.find(c.upper())
+            if value < 0 or value > size:
+                raise ValueError("invalid cell {!r}".format(c))
+            row.append(value)
+        board.append(row)
+
+    return board
+
+def format_board(board):
+    '''Given a board as a list of lists of numbers, return its one-line
+    representation'''
+
+    return ''.join(CELL_CHARS[value] for row in board for value in row)
+
+def read_boards(lines):
+    '''Given an iterable of lines (e.g., a file), yield the board on each
+    line. Blank lines and lines starting with # are skipped'''
+
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield parse_board(line)
+
+def enforce_gac_many(boards, model=1, processes=None, chunksize=64, budget=None):
+    '''Enforce GAC with model 1 or 2 on each of the boards. Yield the
+    pruned domains of each board (as returned by
+    sudoku_enforce_gac_model_1), in order.
+
+    processes is the number of worker processes (by default, one per
+    CPU); with processes=1 the boards are processed in this process.
+    chunksize is the number of boards sent to a worker at a time.
+    budget is as described in the module documentation.'''
+
+    return run_many(_enforce_gac_chunk, boards, (model, budget), processes, chunksize)
+
+def solve_many(boards, model=1, ordering='mrv', processes=None, chunksize=64, budget=None):
+    '''Solve each of the boards with model 1 or 2 and the given variable
+    ordering. Yield the (solution, stats) pair returned by solve for each
+    board, in order. processes, chunksize and budget are as for
+    enforce_gac_many.'''
+
+    return run_many(_solve_chunk, boards, (model, ordering, budget), processes, chunksize)
+
+def run_many(work, boards, args, processes=None, chunksize=64):
+    '''Apply work (a function of a chunk of boards and of args, returning
+    the list of their results) to the boards, a chunk at a time, and yield
+    the results in order. At most 2 chunks per worker process are queued
+    at any time.'''
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    if processes <= 1:
+        for chunk in _chunks(boards, chunksize):
+            for result in work(chunk, *args):
+                yield result
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = deque()
+        for chunk in _chunks(boards, chunksize):
+            pending.append(pool.apply_async(work, (chunk,) + tuple(args)))
+            if len(pending) >= 2 * processes:
+                for result in pending.popleft().get():
+                    yield result
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def _chunks(iterable, size):
+    '''Yield successive lists of up to size items of iterable'''
+
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+#Worker functions (module level, so that they can be sent to the pool)
+
+def _enforce_gac_chunk(boards, model, budget=None):
+    return [compiled_model(model, box_size(board)).enforce_gac(board, budget) for board in boards]
+
+def _solve_chunk(boards, model, ordering, budget=None):
+    return [solve(board, model, ordering, budget) for board in boards]
+
+def main(argv=None):
+    '''Command line interface: read boards, one per line, and write one
+    result per line. With --solve the result is the solved board in the
+    one-line format (or "unsolvable"); otherwise it is the list of pruned
+    domains after GAC, in JSON.'''
+
+    parser = argparse.ArgumentParser(description="Batch sudoku propagation and solving")
+    parser.add_argument('file', nargs='?', default='-',
+                        help="file of boards, one per line (default: standard input)")
+    parser.add_argument('--model', type=int, choices=[1, 2], default=1)
+    parser.add_argument('--solve', action='store_true',
+                        help="solve the boards instead of only enforcing GAC")
+    parser.add_argument('--ordering', choices=sorted(ORDERINGS), default='mrv')
+    parser.add_argument('--processes', '-j', type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument('--chunksize', type=int, default=64)
+    options = parser.parse_args(argv)
+
+    if options.file == '-':
+        infile = sys.stdin
+    else:
+        infile = open(options.file)
+
+    boards = read_boards(infile)
+    if options.solve:
+        for solution, stats in solve_many(boards, options.model, options.ordering,
+                                          options.processes, options.chunksize):
+            if solution is None:
+                sys.stdout.write("unsolvable\n")
+            else:
+                sys.stdout.write(format_board(solution) + "\n")
+    else:
+        for domains in enforce_gac_many(boards, options.model,
+                                        options.processes, options.chunksize):
+            sys.stdout.write(json.dumps(domains) + "\n")
+
+if __name__ == '__main__':
+    main()
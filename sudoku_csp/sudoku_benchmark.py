@@ -0,0 +1,262 @@
+'''Benchmark of the GAC engines on sudoku corpora.
+
+   Each ENGINE enforces the GAC of model 1 or model 2 on a list of boards:
+
+      model1, model2    the Variable/Constraint models
+                        (sudoku_enforce_gac_model_1/_2, compiled)
+      vector1, vector2  the numpy engine of sudoku_vector (only if numpy
+                        is installed)
+      dlx               the exact cover engine of sudoku_dlx (model 2)
+
+   The CORPORA are the boards of test_boards, and boards generated from
+   random solved grids (random symmetries of the test board solutions)
+   by keeping a given number of clues at random:
+
+      easy   36 clues         hard   25 clues         sparse17   17 clues
+
+   (generated boards need not have a unique solution). Any file of boards
+   in the one-line format of sudoku_batch can be added with --corpus.
+
+   For every engine and corpus the benchmark reports, per board, the wall
+   time split into construction, instantiation and propagation, and the
+   counters of cspbase.Profile (revisions, support checks, ...), except
+   tuple checks, which only table constraints make. The
+   compiled models are built in the engine process, once per corpus and
+   board size: their construction time is that of the first board of
+   each size, and 0 for the others. The numpy engines process a corpus
+   as a single batch, so only their mean time per board is known. Each
+   engine runs in its own process, whose peak resident memory (over all
+   the corpora, not per board) is reported as engine_peak_rss_kb.
+
+   The engines computing the same model must return the same domains on
+   every board (for boards with a domain wipe out, only the failure
+   itself is compared, as the domains at the point of failure depend on
+   the propagation order); any difference is reported as a mismatch.
+
+   Results are written as JSON. Given the results of an earlier run with
+   --baseline, the mean time per board of every engine and corpus is
+   compared with it, and the run fails if any is slower by more than
+   --tolerance.
+
+   python sudoku_benchmark.py [--engines model1,model2,...] [--corpora easy,...]
+                              [--count N] [--seed N] [--corpus FILE]
+                              [--output FILE] [--baseline FILE] [--tolerance 0.1]
+'''
+
+from sudoku_batch import *
+from sudoku_dlx import enforce_gac_dlx
+from sudoku_cache import random_transform
+import test_boards
+import argparse
+import json
+import multiprocessing
+import random
+import resource
+import sys
+import time
+
+try:
+    import sudoku_vector
+except ImportError:
+    sudoku_vector = None
+
+
+ENGINES = {'model1': 1, 'model2': 2, 'vector1': 1, 'vector2': 2, 'dlx': 2}
+
+CLUES = {'easy': 36, 'hard': 25, 'sparse17': 17}
+
+
+def available_engines():
+    '''Return the names of the engines that can run here'''
+
+    if sudoku_vector is None:
+        return ['dlx', 'model1', 'model2']
+    return sorted(ENGINES)
+
+def test_board_corpus():
+    '''Return the boards of test_boards (board0, board1, ...)'''
+
+    boards = []
+    while hasattr(test_boards, 'board{}'.format(len(boards))):
+        boards.append(getattr(test_boards, 'board{}'.format(len(boards))))
+    return boards
+
+def generated_corpus(clues, count, seed):
+    '''Return count boards with the given number of clues, each taken at
+    random from a random solved grid'''
+
+    rng = random.Random(seed)
+    grids = [solve(board, 2)[0] for board in test_board_corpus()]
+    boards = []
+    for k in range(count):
+        grid = random_transform(3, rng).apply(rng.choice(grids))
+        keep = set(rng.sample(range(81), clues))
+        boards.append([[grid[i][j] if 9 * i + j in keep else 0 for j in range(9)]
+                       for i in range(9)])
+    return boards
+
+def run_engine(engine, boards):
+    '''Enforce GAC with the engine on each of the boards. Return the list
+    of (domains, ok, record) for each board, where record is a dictionary
+    of the time and counters of the board'''
+
+    if engine.startswith('vector'):
+        start = time.time()
+        cand, ok = sudoku_vector.enforce_gac_batch(boards, ENGINES[engine])
+        elapsed = (time.time() - start) / max(len(boards), 1)
+        return [(sudoku_vector.domains(cand[n]), bool(ok[n]), {'wall': elapsed})
+                for n in range(len(boards))]
+
+    if engine == 'dlx':
+        results = []
+        for board in boards:
+            start = time.time()
+            domains, ok = enforce_gac_dlx(board)
+            results.append((domains, ok, {'wall': time.time() - start}))
+        return results
+
+    #built here rather than taken from compiled_model, which the process
+    #may have inherited already built
+    model = ENGINES[engine]
+    models = {}
+    results = []
+    for board in boards:
+        n = box_size(board)
+        start = time.time()
+        with Profile() as profile:
+            if n not in models:
+                models[n] = CompiledModel(model, n)
+            domains = models[n].enforce_gac(board)
+        record = profile.counters()
+        #no engine has table constraints: always 0
+        del record['tuple_checks']
+        record['times'].setdefault('construction', 0.0)
+        record['wall'] = time.time() - start
+        ok = all(len(d) > 0 for row in domains for d in row)
+        results.append((domains, ok, record))
+    return results
+
+def _run_engine_process(engine, corpora):
+    '''Run the engine on every corpus, in a fresh process (for the peak
+    memory to be that of the engine alone). Return the results and the
+    peak resident memory of the process'''
+
+    results = dict((name, run_engine(engine, boards)) for name, boards in corpora.items())
+    return results, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def benchmark(engines, corpora):
+    '''Run each engine on each corpus (a dictionary of lists of boards).
+    Return the results, as a dictionary ready to be written as JSON'''
+
+    report = {'engines': {}, 'mismatches': []}
+    outputs = {}
+    for engine in engines:
+        pool = multiprocessing.Pool(1)
+        try:
+            results, peak = pool.apply(_run_engine_process, (engine, corpora))
+        finally:
+            pool.terminate()
+            pool.join()
+        outputs[engine] = results
+
+        summary = {'engine_peak_rss_kb': peak, 'corpora': {}}
+        for name, per_board in results.items():
+            records = [record for domains, ok, record in per_board]
+            summary['corpora'][name] = {
+                'boards': len(records),
+                'failed': sum(1 for domains, ok, record in per_board if not ok),
+                'mean_wall': _mean([r['wall'] for r in records]),
+                'per_board': records}
+        report['engines'][engine] = summary
+
+    #engines of the same model must agree on every board
+    for name in corpora:
+        for i, first in enumerate(engines):
+            for other in engines[i + 1:]:
+                if ENGINES[first] != ENGINES[other]:
+                    continue
+                for n, (a, b) in enumerate(zip(outputs[first][name], outputs[other][name])):
+                    if a[1] != b[1] or (a[1] and a[0] != b[0]):
+                        report['mismatches'].append(
+                            {'corpus': name, 'board': n, 'engines': [first, other]})
+    return report
+
+def compare(report, baseline, tolerance):
+    '''Return the list of (engine, corpus, baseline mean, mean) for which
+    the mean time per board of the report is more than tolerance (a
+    fraction) above that of the baseline'''
+
+    regressions = []
+    for engine, summary in report['engines'].items():
+        old = baseline['engines'].get(engine)
+        if old is None:
+            continue
+        for name, corpus in summary['corpora'].items():
+            if name not in old['corpora']:
+                continue
+            before = old['corpora'][name]['mean_wall']
+            after = corpus['mean_wall']
+            if after > before * (1 + tolerance):
+                regressions.append((engine, name, before, after))
+    return regressions
+
+def _mean(values):
+    if not values:
+        return 0.0
+    return sum(values) / float(len(values))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the sudoku GAC engines")
+    parser.add_argument('--engines', default=','.join(available_engines()))
+    parser.add_argument('--corpora', default='test_boards,' + ','.join(sorted(CLUES)))
+    parser.add_argument('--count', type=int, default=50,
+                        help="number of boards of each generated corpus")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--corpus', action='append', default=[],
+                        help="file of boards to add as a corpus (may be repeated)")
+    parser.add_argument('--output', default='-', help="JSON results file (default: standard output)")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    options = parser.parse_args(argv)
+
+    engines = [e for e in options.engines.split(',') if e]
+    for engine in engines:
+        if engine not in available_engines():
+            parser.error("engine {} is not available".format(engine))
+
+    corpora = {}
+    for name in [c for c in options.corpora.split(',') if c]:
+        if name == 'test_boards':
+            corpora[name] = test_board_corpus()
+        elif name in CLUES:
+            corpora[name] = generated_corpus(CLUES[name], options.count, options.seed)
+        else:
+            parser.error("unknown corpus {}".format(name))
+    for path in options.corpus:
+        with open(path) as f:
+            corpora[path] = list(read_boards(f))
+
+    report = benchmark(engines, corpora)
+    text = json.dumps(report, indent=1, sort_keys=True)
+    if options.output == '-':
+        sys.stdout.write(text + "\n")
+    else:
+        with open(options.output, 'w') as f:
+            f.write(text + "\n")
+
+    for m in report['mismatches']:
+        sys.stderr.write("MISMATCH: {} and {} on board {} of {}\n".format(
+            m['engines'][0], m['engines'][1], m['board'], m['corpus']))
+    status = 1 if report['mismatches'] else 0
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        for engine, name, before, after in compare(report, baseline, options.tolerance):
+            sys.stderr.write("REGRESSION: {} on {}: {:.6f}s -> {:.6f}s per board\n".format(
+                engine, name, before, after))
+            status = 1
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,310 @@
+'''Result cache keyed by the symmetry class of a board.
+
+   Boards that are the same up to the sudoku symmetries (relabeling of the
+   digits, permutation of the bands, of the rows within a band, of the
+   stacks, of the columns within a stack, and transposition) have the
+   same GAC domains and solutions, up to the same symmetry. The cache
+   stores results for a canonical representative of each class, and maps
+   them back to the orientation of the board asked for.
+
+   CANONICAL FORM: the rows and columns of a board are ordered by
+   invariants (clue counts, and the frequencies in the board of their
+   digits), and the orientation is chosen by comparing the invariants of
+   the rows with those of the columns. Every transformation agreeing with
+   this order is a candidate (only ties between equal invariants are
+   enumerated), the digits of each candidate are relabeled in order of
+   first appearance, and the canonical form is the lexicographically
+   smallest candidate. As the candidates are defined by invariants, every
+   board of a class gets the same canonical form. For highly symmetric
+   boards (e.g., nearly empty ones) the number of candidates is capped at
+   MAX_CANDIDATES; their canonical form is then still an exact
+   transformation of the board, so results remain correct, but other
+   boards of the class may get a different key.
+
+   ResultCache is an LRU cache, optionally saved to (and loaded from) a
+   file. cached_enforce_gac and cached_solve put it in front of the model
+   functions and solve.
+
+   For a board with a domain wipe out the cached domains are those of the
+   canonical board, which (like the domains returned at a wipe out by
+   enforce_gac itself) depend on the propagation order; only the failure
+   is guaranteed to match. For a board with several solutions, the
+   solution returned is that of the canonical board.
+
+   Given a cspbase.Budget, a result computed when it ran out (partly
+   pruned domains, or an incomplete search) is returned but not cached.
+'''
+
+from sudoku_batch import *
+from collections import OrderedDict
+import cPickle as pickle
+import itertools
+import os
+import random
+
+
+MAX_CANDIDATES = 2000
+
+
+class Transform(object):
+    '''A sudoku symmetry: the cell at (i, j) of the transformed board is
+    the cell at (rows[i], cols[j]) of the board (of its transpose if
+    transpose is True), with its value v replaced by relabel[v]'''
+
+    def __init__(self, transpose, rows, cols, relabel):
+        self.transpose = transpose
+        self.rows = rows
+        self.cols = cols
+        self.relabel = relabel          #value -> value, 0 -> 0
+
+    def apply(self, grid, values=None):
+        '''Transform the grid (a list of lists of cells). values maps a
+        cell to its transformed cell; by default cells are values and are
+        relabeled'''
+        if values is None:
+            values = self.relabel.__getitem__
+        if self.transpose:
+            grid = zip(*grid)
+        return [[values(grid[r][c]) for c in self.cols] for r in self.rows]
+
+    def inverse(self):
+        '''Return the inverse transformation'''
+        rows = [0] * len(self.rows)
+        cols = [0] * len(self.cols)
+        for i, r in enumerate(self.rows):
+            rows[r] = i
+        for j, c in enumerate(self.cols):
+            cols[c] = j
+        relabel = dict((new, old) for old, new in self.relabel.items())
+        if self.transpose:
+            #(B^T)[rows][cols] = K  <=>  B = (K[rows^-1][cols^-1])^T
+            #                            = K^T[cols^-1][rows^-1]
+            return Transform(True, cols, rows, relabel)
+        return Transform(False, rows, cols, relabel)
+
+    def apply_domains(self, domains):
+        '''Transform a board of domains (lists of values)'''
+        relabel = self.relabel
+        return self.apply(domains, lambda d: sorted(relabel[v] for v in d))
+
+
+def random_transform(n, rng=random):
+    '''Return a random sudoku symmetry of boards with boxes of dimension
+    n, drawn with rng (a random.Random, or the random module)'''
+
+    size = n * n
+    digits = range(1, size + 1)
+    rng.shuffle(digits)
+    relabel = dict(zip(range(size + 1), [0] + digits))
+
+    def lines():
+        bands = range(n)
+        rng.shuffle(bands)
+        order = []
+        for band in bands:
+            within = range(n)
+            rng.shuffle(within)
+            order.extend(n * band + k for k in within)
+        return order
+
+    return Transform(rng.random() < 0.5, lines(), lines(), relabel)
+
+def canonical_form(board):
+    '''Return (key, transform): the canonical form of the board in the
+    one-line format of sudoku_batch, and the Transform mapping the board
+    to it'''
+
+    n = box_size(board)
+    size = n * n
+    freq = [0] * (size + 1)
+    for row in board:
+        for v in row:
+            freq[v] += 1
+    freq[0] = 0
+
+    best = None
+    orientations = [(False, board), (True, [list(col) for col in zip(*board)])]
+    keyed = [(_orientation_invariant(grid, n, freq), transpose, grid)
+             for transpose, grid in orientations]
+    smallest = min(k[0] for k in keyed)
+
+    count = 0
+    for invariant, transpose, grid in keyed:
+        if invariant != smallest:
+            continue
+        row_orders = _line_orders(grid, n, freq)
+        col_orders = _line_orders([list(col) for col in zip(*grid)], n, freq)
+        for rows, cols in itertools.product(row_orders, col_orders):
+            cells, relabel = _relabeled(grid, rows, cols, size)
+            if best is None or cells < best[0]:
+                best = (cells, Transform(transpose, list(rows), list(cols), relabel))
+            count += 1
+            if count >= MAX_CANDIDATES:
+                break
+        if count >= MAX_CANDIDATES:
+            break
+
+    cells, transform = best
+    return format_board([cells[size * i:size * i + size] for i in range(size)]), transform
+
+def _line_features(grid, n, freq):
+    '''Return the invariant of each row of grid: its clue count, the
+    sorted frequencies of its digits, and the sorted clue counts of its
+    intersections with the stacks'''
+
+    features = []
+    for row in grid:
+        stacks = sorted(sum(1 for v in row[n * s:n * s + n] if v) for s in range(n))
+        features.append((sum(1 for v in row if v),
+                         tuple(sorted(freq[v] for v in row if v)),
+                         tuple(stacks)))
+    return features
+
+def _band_keys(grid, n, freq):
+    '''Return the row features, and for each band the sorted features of
+    its rows'''
+
+    features = _line_features(grid, n, freq)
+    bands = [tuple(sorted(features[n * b:n * b + n])) for b in range(n)]
+    return features, bands
+
+def _orientation_invariant(grid, n, freq):
+    '''Return an invariant of the board in this orientation, used to
+    choose between the board and its transpose'''
+
+    rows = sorted(_band_keys(grid, n, freq)[1])
+    cols = sorted(_band_keys([list(c) for c in zip(*grid)], n, freq)[1])
+    return (rows, cols)
+
+def _line_orders(grid, n, freq):
+    '''Return the row orders of grid consistent with the sorted order of
+    the band and row invariants (every order among equal invariants)'''
+
+    features, bands = _band_keys(grid, n, freq)
+    band_orders = _tied_orders(range(n), lambda b: bands[b])
+    within = [_tied_orders(range(n * b, n * b + n), lambda r: features[r]) for b in range(n)]
+
+    orders = []
+    for band_order in band_orders:
+        for parts in itertools.product(*[within[b] for b in band_order]):
+            orders.append(tuple(r for part in parts for r in part))
+            if len(orders) >= MAX_CANDIDATES:
+                return orders
+    return orders
+
+def _tied_orders(items, key):
+    '''Return the orders of items sorted by key, with every permutation
+    of the items having equal keys'''
+
+    items = sorted(items, key=key)
+    groups = [list(g) for k, g in itertools.groupby(items, key)]
+    orders = []
+    for perms in itertools.product(*[itertools.permutations(g) for g in groups]):
+        orders.append(tuple(i for p in perms for i in p))
+        if len(orders) >= MAX_CANDIDATES:
+            break
+    return orders
+
+def _relabeled(grid, rows, cols, size):
+    '''Return the cells of grid in the row and column orders, with the
+    digits relabeled in order of first appearance, and the relabeling'''
+
+    relabel = {0: 0}
+    cells = []
+    for r in rows:
+        row = grid[r]
+        for c in cols:
+            v = row[c]
+            if v not in relabel:
+                relabel[v] = len(relabel)
+            cells.append(relabel[v])
+    #digits absent from the board take the remaining labels in order
+    for v in range(1, size + 1):
+        if v not in relabel:
+            relabel[v] = len(relabel)
+    return cells, relabel
+
+
+class ResultCache(object):
+    '''An LRU cache of at most capacity results. If path is given, the
+    cache is loaded from that file (if it exists) and save() writes it
+    back.'''
+
+    def __init__(self, capacity=100000, path=None):
+        self.capacity = capacity
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.entries = pickle.load(f)
+            self._evict()
+
+    def get(self, key):
+        '''Return the result stored for key (making it the most recently
+        used), or None'''
+        value = self.entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries[key] = value
+        return value
+
+    def put(self, key, value):
+        '''Store the result for key'''
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        self._evict()
+
+    def save(self):
+        '''Write the cache to its file'''
+        if self.path is None:
+            raise ValueError("cache has no file")
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(self.entries, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.path)
+
+    def _evict(self):
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+DEFAULT_CACHE = ResultCache()
+
+def cached_enforce_gac(initial_sudoku_board, model=1, cache=None, budget=None):
+    '''Return the domains of sudoku_enforce_gac_model_1 (or _2) for the
+    board, from the cache (DEFAULT_CACHE if not given) if an equivalent
+    board has been seen'''
+
+    if cache is None:
+        cache = DEFAULT_CACHE
+    key, transform = canonical_form(initial_sudoku_board)
+    domains = cache.get(('gac', model, key))
+    if domains is None:
+        canonical = transform.apply(initial_sudoku_board)
+        domains = compiled_model(model, box_size(canonical)).enforce_gac(canonical, budget)
+        if budget is None or not budget.exhausted:
+            cache.put(('gac', model, key), domains)
+    return transform.inverse().apply_domains(domains)
+
+def cached_solve(initial_sudoku_board, model=1, ordering='mrv', cache=None, budget=None):
+    '''Return the (solution, stats) of solve for the board, from the cache
+    (DEFAULT_CACHE if not given) if an equivalent board has been seen'''
+
+    if cache is None:
+        cache = DEFAULT_CACHE
+    key, transform = canonical_form(initial_sudoku_board)
+    result = cache.get(('solve', model, key))
+    if result is None:
+        result = solve(transform.apply(initial_sudoku_board), model, ordering, budget)
+        if not result[1].get('incomplete'):
+            cache.put(('solve', model, key), result)
+    solution, stats = result
+    stats = dict(stats)
+    if solution is not None:
+        solution = transform.inverse().apply(solution)
+    if 'domains' in stats:
+        stats['domains'] = transform.inverse().apply_domains(stats['domains'])
+    return solution, stats
@@ -2,58 +2,120 @@
 '''
 
 from cspbase import *
-import itertools 
+import cspbase
+from collections import deque
+import threading
 
 
-def enforce_gac(constraint_list):
+def enforce_gac(constraint_list, var_cons=None, initial=None, weights=None, budget=None):
     '''Input a list of constraint objects, each representing a constraint, then 
        enforce GAC on them pruning values from the variables in the scope of
        these constraints. Return False if a DWO is detected. Otherwise, return True. 
        The pruned values will be reflected in the variable object cur_domain (i.e.,
        enforce_gac will modify the variable objects that are in the scope of
-       the constraints passed to it.'''
+       the constraints passed to it.
+       
+       Optionally, var_cons is the index of constraint_list built by GAC_index
+       (so callers propagating repeatedly need not rebuild it), initial is
+       the list of constraints to revise first (by default all of them; the
+       others must already be GAC), and weights is a dictionary of constraint
+       weights, in which the weight of a constraint causing a DWO is
+       incremented (for the dom/wdeg heuristic).
+
+       If a cspbase.Budget is given and runs out, propagation stops with
+       the values pruned so far (the domains still contain every
+       solution, but need not be GAC) and True is returned; the budget is
+       then marked exhausted.'''
     
-    Q = []
+    if var_cons is None:
+        var_cons = GAC_index(constraint_list)
+    if initial is None:
+        initial = constraint_list
     
-    #initially, queue contains all the constraints
-    for n in constraint_list: 
-        Q.append(n)
+    #initially, queue contains all the constraints. inQ mirrors the
+    #queue contents for O(1) membership tests
+    Q = deque(initial)
+    inQ = set(initial)
+    
+    #statistics are collected only if a cspbase.Profile is active
+    profile = cspbase.PROFILE
+    if profile is not None:
+        profile.queue_pushes += len(Q)
     
     while len(Q) > 0:
         #consider the first constraint on the queue
-        C = Q.pop(0)
-                            
-        for V in C.scope:
-            for d in V.cur_domain():
-                
-                #if d in fixed:
-                if not C.has_support(V, d):
-                    #prune this domain value of the variable,
-                    #since it cannot lead to a solution
-                    V.prune_value(d)
-                    
-                    if V.cur_domain() == []:
-                        #domain wipe out
-                        return False
-                    else:
-                        #enqueue relevant constraints
-                        Q = GAC_enq(constraint_list, Q, V)                        
+        C = Q.popleft()
+        inQ.discard(C)
+        
+        #revise C until it is GAC (see Constraint.revise). C is then
+        #consistent, and only the other constraints on the pruned variables
+        #need to be enqueued
+        pruned = C.revise()
+        if profile is not None:
+            profile.revised(C, pruned)
+        
+        for V in pruned:
+            if V.cur_domain_size() == 0:
+                #domain wipe out
+                if profile is not None:
+                    profile.wipeouts += 1
+                if weights is not None:
+                    weights[C] = weights.get(C, 1) + 1
+                return False
+            else:
+                #enqueue relevant constraints
+                GAC_enq(var_cons[V], Q, inQ, C)
+        
+        if budget is not None and budget.revised():
+            #out of budget: the constraints still queued may not be GAC
+            return True
                 
     return True
      
-#GAC enforce helper method           
-def GAC_enq(cList, Q, V):
-    '''Given cList (the list of all constraints), Q (a queue of constraints,
-    a subset of cList), and a variable V, enqueue every contraint containing 
-    variable V into Q'''
+#GAC enforce helper methods
+def GAC_index(cList):
+    '''Given cList (a list of constraints), return a dictionary mapping
+    each variable to the list of constraints whose scope contains it'''
     
+    var_cons = {}
     for C in cList:
-        if (V in C.scope) and (not(C in Q)):
+        for V in C.scope:
+            cons = var_cons.setdefault(V, [])
+            if len(cons) == 0 or cons[-1] is not C:
+                cons.append(C)
+            
+    return var_cons
+
+def peer_index(var_cons):
+    '''Given var_cons (built by GAC_index), return a dictionary mapping
+    each variable to the list of the other variables sharing a constraint
+    with it'''
+
+    peers = {}
+    for V, cons in var_cons.items():
+        others = set()
+        for C in cons:
+            others.update(C.scope)
+        others.discard(V)
+        peers[V] = list(others)
+    return peers
+           
+def GAC_enq(cons, Q, inQ, current):
+    '''Given cons (the constraints containing a pruned variable), Q (a queue
+    of constraints) and inQ (the set of constraints in Q), enqueue every
+    constraint of cons that is not already in Q, except current (the
+    constraint being revised)'''
+    
+    for C in cons:
+        if (C is not current) and (not(C in inQ)):
             Q.append(C)
+            inQ.add(C)
+            if cspbase.PROFILE is not None:
+                cspbase.PROFILE.queue_pushes += 1
             
     return Q
 
-def sudoku_enforce_gac_model_1(initial_sudoku_board):
+def sudoku_enforce_gac_model_1(initial_sudoku_board, budget=None):
     '''The input board is specified as a list of 9 lists. Each of the
        9 lists represents a row of the board. If a 0 is in the list it
        represents an empty cell. Otherwise if a number between 1--9 is
@@ -118,9 +180,28 @@ def sudoku_enforce_gac_model_1(initial_sudoku_board):
        
        Of course, GAC would prune some variable domains so this would
        not be the outputted list.
+
+       Larger boards are specified the same way: for a box dimension n,
+       n*n lists of n*n numbers between 0 and n*n (e.g., 16x16 boards with
+       4x4 boxes, or 25x25 boards with 5x5 boxes).
+
+       If a cspbase.Budget is given, propagation stops when it runs out
+       (budget.exhausted is then True), and the domains returned are
+       only partly pruned.
        
        '''
-    #generate all 81 variables for each cell on the board
+    #the variables and constraints are built once and reused for every
+    #board (see CompiledModel). ENFORCE GAC on these contraints; the
+    #results will contain the updated domain values (in the case of a DWO,
+    #some variable domains will be empty
+    n = box_size(initial_sudoku_board)
+    return compiled_model(1, n).enforce_gac(initial_sudoku_board, budget)
+
+def sudoku_model_1(initial_sudoku_board):
+    '''Build the variables and constraints of model_1 (see
+    sudoku_enforce_gac_model_1) for the board, without enforcing GAC. Return
+    the rows of variables and the list of constraints.'''
+    #generate a variable for each cell on the board
     variables = make_variables(initial_sudoku_board)       
     
     #first, create lists of variables for the variables in the same column 
@@ -131,64 +212,52 @@ def sudoku_enforce_gac_model_1(initial_sudoku_board):
     #GENERATE THE CONSTRAINTS:
   
     constraints = []
-    checker = [] #will help ignore redundant constraints
+    checker = set() #will help ignore redundant constraints
                      #eg. if a row constraint exists between (v1, v2),
                      #then we don't need a col/box constraint for them as well
              
     #binary row constraints
-    for r in variables:
-        for c1 in r:
-            for c2 in r[r.index(c1) + 1:]:
+    for k, r in enumerate(variables):
+        for i1, c1 in enumerate(r):
+            for i2 in range(i1 + 1, len(r)):
+                c2 = r[i2]
                 #no need for checker here, because there are no constraints yet
-                cons = Constraint("BIN-ROW: (R" + str(variables.index(r)) + \
-                                  ", C" + str(r.index(c1)) +") and (R" + str(variables.index(r)) + \
-                                  ", C" + str(r.index(c2)) + ")", [c1, c2])
+                cons = NotEqualConstraint("BIN-ROW: (R" + str(k) + \
+                                  ", C" + str(i1) +") and (R" + str(k) + \
+                                  ", C" + str(i2) + ")", [c1, c2])
                     
-                cons.add_satisfying_tuples(binary_permutations(c1, c2))
                 constraints.append(cons)
-                checker.append((c1, c2))
+                checker.add((c1, c2))
     
     #binary col constraints
-    for r in cols:
-        for c1 in r:
-            for c2 in r[r.index(c1) + 1:]:
+    for k, r in enumerate(cols):
+        for i1, c1 in enumerate(r):
+            for i2 in range(i1 + 1, len(r)):
+                c2 = r[i2]
                 if (c1, c2) not in checker:
-                    cons = Constraint("BIN-COL: (R" + str(cols.index(r)) + \
-                                  ", C" + str(r.index(c1)) +") and (R" + str(cols.index(r)) + \
-                                  ", C" + str(r.index(c2)) + ")", [c1, c2]) 
-                    cons.add_satisfying_tuples(binary_permutations(c1, c2))
+                    cons = NotEqualConstraint("BIN-COL: (R" + str(k) + \
+                                  ", C" + str(i1) +") and (R" + str(k) + \
+                                  ", C" + str(i2) + ")", [c1, c2]) 
                     constraints.append(cons)
-                    checker.append((c1, c2))
+                    checker.add((c1, c2))
                                         
     #binary box constraints
-    for r in boxes:
-        for c1 in r:
-            for c2 in r[r.index(c1) + 1:]:
+    for k, r in enumerate(boxes):
+        for i1, c1 in enumerate(r):
+            for i2 in range(i1 + 1, len(r)):
+                c2 = r[i2]
                 if (c1, c2) not in checker:
-                    cons = Constraint("BIN-BOX: (R" + str(boxes.index(r)) + \
-                                  ", C" + str(r.index(c1)) +") and (R" + str(boxes.index(r)) + \
-                                  ", C" + str(r.index(c2)) + ")", [c1, c2]) 
-                    cons.add_satisfying_tuples(binary_permutations(c1, c2))
+                    cons = NotEqualConstraint("BIN-BOX: (R" + str(k) + \
+                                  ", C" + str(i1) +") and (R" + str(k) + \
+                                  ", C" + str(i2) + ")", [c1, c2]) 
                     constraints.append(cons)
-                    checker.append((c1, c2))                       
-                
-                
-    #ENFORCE GAC on these contraints:
-    result_list = [[], [], [], [], [], [], [], [], []]
-    
-    e = enforce_gac(constraints)
+                    checker.add((c1, c2))
     
-    #results_list will contain the updated domain values (in the case of a DWO,
-    #some variable domains will be empty
-    for r in variables:
-        for c in r:
-            result_list[variables.index(r)].append(c.cur_domain())
-        
-    return result_list       
+    return variables, constraints
 
 ##############################
 
-def sudoku_enforce_gac_model_2(initial_sudoku_board):
+def sudoku_enforce_gac_model_2(initial_sudoku_board, budget=None):
     '''This function takes the same input format (a list of 9 lists
     specifying the board, and generates the same format output as
     sudoku_enforce_gac_model_1.
@@ -206,7 +275,20 @@ def sudoku_enforce_gac_model_2(initial_sudoku_board):
     a single value in their domain). model_2 should create these
     all-different constraints between the relevant variables, then
     invoke enforce_gac on those constraints.
+
+    A budget is handled as by sudoku_enforce_gac_model_1.
     '''
+    #the variables and constraints are built once and reused for every
+    #board (see CompiledModel). ENFORCE GAC on the constraints; the
+    #results will contain the updated domain values (in the case of a DWO,
+    #some variable domains will be empty
+    n = box_size(initial_sudoku_board)
+    return compiled_model(2, n).enforce_gac(initial_sudoku_board, budget)
+
+def sudoku_model_2(initial_sudoku_board):
+    '''Build the variables and constraints of model_2 (see
+    sudoku_enforce_gac_model_2) for the board, without enforcing GAC. Return
+    the rows of variables and the list of constraints.'''
     variables = make_variables(initial_sudoku_board)       
     
     #first, create lists of variables for variables in the same column 
@@ -217,51 +299,122 @@ def sudoku_enforce_gac_model_2(initial_sudoku_board):
     #GENERATE THE CONSTRAINTS: 
   
     constraints = []
-    perms = list(itertools.permutations(range(10)[1:])) #all permutations of satisfying
-                                                        #tuples for 9 variables
+    #the all-different constraints compute their supports by bipartite
+    #matching, so no satisfying tuples are enumerated
              
     #all-diff row constraints
-    for r in variables:
-        cons = Constraint("ALLDIFF-ROW: R" + str(variables.index(r)), r)                    
-        cons.add_satisfying_tuples(alldif_permutations(r, perms))
+    for k, r in enumerate(variables):
+        cons = AllDiffConstraint("ALLDIFF-ROW: R" + str(k), r)                    
         constraints.append(cons)
     
     #all-diff col constraints
-    for c in cols:
-        cons = Constraint("ALLDIFF-COL: C" + str(cols.index(c)), c) 
-        cons.add_satisfying_tuples(alldif_permutations(c, perms))
+    for k, c in enumerate(cols):
+        cons = AllDiffConstraint("ALLDIFF-COL: C" + str(k), c) 
         constraints.append(cons)
                                         
     #all-diff box constraints
-    for b in boxes:
-        cons = Constraint("ALLDIFF-BOX: B" + str(boxes.index(b)), b) 
-        cons.add_satisfying_tuples(alldif_permutations(b, perms))
+    for k, b in enumerate(boxes):
+        cons = AllDiffConstraint("ALLDIFF-BOX: B" + str(k), b) 
         constraints.append(cons)
-                                                  
-                
-    #ENFORCE GAC on the constraints:
-    result_list = [[], [], [], [], [], [], [], [], []]
     
-    e = enforce_gac(constraints)
+    return variables, constraints
+
+##############################
+
+class CompiledModel(object):
+    '''The variables and constraints of model_1 or model_2 do not depend on
+    the board, only their initial domains do. A CompiledModel builds them
+    once (for a board with no pre-set cells) and is then instantiated for
+    each board by resetting the current domains of its variables and
+    pruning the pre-set cells to their value.
+
+    A compiled model is specific to a grid geometry: n is the box
+    dimension, for boards of n*n rows of n*n cells (3 for 9x9 boards).
+
+    The variables and constraints are shared by every board instantiated,
+    so a compiled model can only hold one board at a time; use
+    compiled_model to get the one belonging to the current thread.'''
+
+    def __init__(self, model, n=3):
+        if model == 1:
+            builder = sudoku_model_1
+        elif model == 2:
+            builder = sudoku_model_2
+        else:
+            raise ValueError("unknown model {}".format(model))
+        self.model = model
+        self.n = n
+        with profile_phase('construction'):
+            self.variables, self.constraints = builder([[0] * (n * n) for i in range(n * n)])
+            self.var_cons = GAC_index(self.constraints)
+            self.peers = peer_index(self.var_cons)
+
+    def instantiate(self, initial_sudoku_board):
+        '''Set the current domains of the variables for the board, and
+        return the rows of variables'''
+        if box_size(initial_sudoku_board) != self.n:
+            raise ValueError("board is not {0}x{0}".format(self.n * self.n))
+        with profile_phase('instantiation'):
+            for row, values in zip(self.variables, initial_sudoku_board):
+                for V, value in zip(row, values):
+                    #forget any trail of a previous search on this model
+                    V.trail = None
+                    V.restore_curdom()
+                    if value != 0:
+                        V.assign(value)
+        return self.variables
+
+    def enforce_gac(self, initial_sudoku_board, budget=None):
+        '''Instantiate the model for the board and enforce GAC on it.
+        Return the pruned domains, in the format of
+        sudoku_enforce_gac_model_1 (only partly pruned if the budget, if
+        given, runs out)'''
+        self.instantiate(initial_sudoku_board)
+        with profile_phase('propagation'):
+            enforce_gac(self.constraints, self.var_cons, budget=budget)
+        return cur_domains(self.variables)
+
+_compiled = threading.local()
+
+def compiled_model(model, n=3):
+    '''Return the CompiledModel of model 1 or 2 for boxes of dimension n,
+    building it the first time it is requested by the current thread'''
     
-    #results_list will contain the updated domain values (in the case of a DWO,
-    #some variable domains will be empty
-    for r in variables:
-        for c in r:
-            result_list[variables.index(r)].append(c.cur_domain())
-        
-    return result_list       
+    models = _compiled.__dict__.setdefault('models', {})
+    if (model, n) not in models:
+        models[(model, n)] = CompiledModel(model, n)
+    return models[(model, n)]
 
 ##############################
 
 #Helper functions
 
+def cur_domains(variables):
+    '''Given the rows of variables of a board, return the same layout with
+    each variable replaced by its current domain'''
+    
+    result_list = []
+    for r in variables:
+        result_list.append([c.cur_domain() for c in r])
+        
+    return result_list
+
+def box_size(board):
+    '''Given a board (a list of n*n rows of n*n cells), return the box
+    dimension n'''
+    
+    size = len(board)
+    n = int(round(size ** 0.5))
+    if n < 1 or n * n != size or any(len(row) != size for row in board):
+        raise ValueError("a board must have n*n rows of n*n cells")
+    return n
+
 def group_cols(variables):
     '''Given the sudoku board representation, group the variables that belong 
      to the same column'''
-    temp = range(9)
+    temp = range(len(variables))
     
-    cols = [[], [], [], [], [], [], [], [], []]
+    cols = [[] for i in temp]
     
     for i in temp:
         for j in temp:
@@ -271,32 +424,14 @@ def group_cols(variables):
          
 def group_boxes(variables):
     '''Given the sudoku board representation, group the variables that belong 
-    to the same box'''
-    temp = range(9)
+    to the same box (numbered row by row, and each listed row by row)'''
+    n = box_size(variables)
             
-    boxes = [[], [], [], [], [], [], [], [], []]
+    boxes = [[] for i in range(n * n)]
               
-    for h in temp[0:3]:
-        for i1 in temp[0:3]:
-            boxes[0].append(variables[h][i1])
-        for j1 in temp[3:6]:
-            boxes[1].append(variables[h][j1])
-        for k1 in temp[6:9]:
-            boxes[2].append(variables[h][k1])
-        
-        for i2 in temp[0:3]:
-            boxes[3].append(variables[h+3][i2])
-        for j2 in temp[3:6]:
-            boxes[4].append(variables[h+3][j2])
-        for k2 in temp[6:9]:
-            boxes[5].append(variables[h+3][k2])
-    
-        for i3 in temp[0:3]:
-            boxes[6].append(variables[h+6][i3])
-        for j3 in temp[3:6]:
-            boxes[7].append(variables[h+6][j3])
-        for k3 in temp[6:9]:
-            boxes[8].append(variables[h+6][k3])
+    for i, row in enumerate(variables):
+        for j, V in enumerate(row):
+            boxes[n * (i // n) + j // n].append(V)
             
     return boxes
                   
@@ -304,58 +439,21 @@ def make_variables(board):
     '''Given a list of lists representing each cell in a sudoku board, generate 
     variables for each cell of the board'''
     
+    size = len(board)
     variables = []
-    for i in range(9): variables.append([])
+    for i in range(size): variables.append([])
     
-    #set up 81 variables, one for each cell on the board
-    for row in board:
-        for col in row:
-            V = Variable("CELL(" + str(board.index(row)) + ", " + str(col) + ")")
+    #set up a variable for each cell on the board (rows are looked up by
+    #position, as a board can have identical rows)
+    for i, row in enumerate(board):
+        for j, col in enumerate(row):
+            V = Variable("CELL(" + str(i) + ", " + str(j) + ")")
                                     
             if col == 0:
-                V.add_domain_values(range(10)[1:])
+                V.add_domain_values(range(1, size + 1))
             else:
                 V.add_domain_values([col])
             
-            variables[board.index(row)].append(V)
+            variables[i].append(V)
         
     return variables
-
-def binary_permutations(V1, V2):
-    '''Given two variables, compute the satisfying tuples for the two variables 
-    that satisfy a binary not-equals constraint (ie. all combinations (n, m) of 
-    values in the domains of the V1 and V2 such that n != m)'''
-    L = []
-    for n in V1.domain():
-        for m in V2.domain():
-            if n != m:
-                L.append([n, m])
-    
-    return L
-
-def alldif_permutations(V, perms):
-    '''Given a list of (9) variables, and all permutations of their satisfying tuples,
-    compute the satisfying tuples for the variables such that they satisfy an 
-    all-diff constraint'''
-    
-    fixed = [] #will keep track of all variables with a single domain value
-    L = []
-    
-    for v in V:
-        if len(v.cur_domain()) == 1:
-            fixed.append((V.index(v), v.cur_domain()[0]))
-            #append (index, value)
-            
-    #after the following loop, L will contain all permutations of satisfying 
-    #tuples where the fixed values match up (ie. ignores all others)
-    for p in perms:
-        test = True
-        for f in fixed:
-            if p[f[0]] != f[1]:
-                test = False
-                break
-        
-        #if the permutation contains the correct fixed values, take it
-        if (test): L.append(p)
-        
-    return L
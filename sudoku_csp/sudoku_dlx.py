@@ -0,0 +1,375 @@
+'''Exact cover engine for sudoku (Algorithm X with Dancing Links).
+
+   A board of N x N cells (N = n*n) is an exact cover problem with one
+   ROW per candidate (cell, value), N**3 rows, and one COLUMN per
+   requirement, 4*N**2 columns (324 for 9x9 boards):
+
+      cell (i, j) has a value        value v is in row i
+      value v is in column j         value v is in box b
+
+   and each candidate row covers the 4 columns it satisfies. A solution
+   is a set of rows covering every column exactly once. The matrix is
+   stored as Knuth's dancing links: circular doubly linked lists of the
+   nodes of each row and each column (here as parallel lists of node
+   numbers), so that covering a column and uncovering it on
+   backtracking only relink nodes.
+
+   solve_dlx and count_solutions_dlx search for solutions, choosing at
+   each node the column with the fewest rows.
+
+   enforce_gac_dlx only propagates, and returns the domains of model 2
+   (sudoku_enforce_gac_model_2): columns with a single row are selected
+   (naked and hidden singles), and for every unit, the rows of the values
+   of a Hall set (k cells with k values between them) are removed from
+   the other cells of the unit, until neither applies. The values to
+   remove are those left without support by an all-different constraint
+   over the open cells of the unit (found by matching, as in
+   cspbase.AllDiffConstraint), not by enumerating the subsets of cells,
+   so that this stays polynomial for any box dimension.
+'''
+
+from sudoku_csp import *
+
+
+class ExactCover(object):
+    '''A dancing links matrix with columns 0 to ncols - 1, and a row for
+    each list of column numbers in rows'''
+
+    def __init__(self, ncols, rows):
+        #node 0 is the root, nodes 1 to ncols the column headers
+        self.L = range(-1, ncols)
+        self.L[0] = ncols
+        self.R = range(1, ncols + 2)
+        self.R[ncols] = 0
+        self.U = range(ncols + 1)
+        self.D = range(ncols + 1)
+        self.C = range(ncols + 1)
+        self.ROW = [-1] * (ncols + 1)
+        self.size = [0] * (ncols + 1)
+        self.first = []                 #first node of each row
+
+        L, R, U, D, C = self.L, self.R, self.U, self.D, self.C
+        for r, columns in enumerate(rows):
+            first = len(C)
+            self.first.append(first)
+            for k, col in enumerate(columns):
+                c = col + 1
+                x = len(C)
+                L.append(x - 1 if k > 0 else first + len(columns) - 1)
+                R.append(x + 1 if k < len(columns) - 1 else first)
+                U.append(U[c])
+                D.append(c)
+                C.append(c)
+                self.ROW.append(r)
+                D[U[c]] = x
+                U[c] = x
+                self.size[c] += 1
+
+    def cover(self, c):
+        '''Remove column c, and the rows covering it from the other
+        columns'''
+        L, R, U, D, C, size = self.L, self.R, self.U, self.D, self.C, self.size
+        L[R[c]] = L[c]
+        R[L[c]] = R[c]
+        i = D[c]
+        while i != c:
+            j = R[i]
+            while j != i:
+                D[U[j]] = D[j]
+                U[D[j]] = U[j]
+                size[C[j]] -= 1
+                j = R[j]
+            i = D[i]
+
+    def uncover(self, c):
+        '''Undo cover(c)'''
+        L, R, U, D, C, size = self.L, self.R, self.U, self.D, self.C, self.size
+        i = U[c]
+        while i != c:
+            j = L[i]
+            while j != i:
+                size[C[j]] += 1
+                D[U[j]] = j
+                U[D[j]] = j
+                j = L[j]
+            i = U[i]
+        L[R[c]] = c
+        R[L[c]] = c
+
+    def select(self, x):
+        '''Add the row of node x to the solution: cover its columns'''
+        R = self.R
+        self.cover(self.C[x])
+        j = R[x]
+        while j != x:
+            self.cover(self.C[j])
+            j = R[j]
+
+    def unselect(self, x):
+        '''Undo select(x)'''
+        L = self.L
+        j = L[x]
+        while j != x:
+            self.uncover(self.C[j])
+            j = L[j]
+        self.uncover(self.C[x])
+
+    def remove_row(self, r):
+        '''Remove row r from the (uncovered) columns, for good'''
+        U, D, R, C, size = self.U, self.D, self.R, self.C, self.size
+        x = self.first[r]
+        j = x
+        while True:
+            D[U[j]] = D[j]
+            U[D[j]] = U[j]
+            size[C[j]] -= 1
+            j = R[j]
+            if j == x:
+                break
+
+    def column_rows(self, c):
+        '''Return the rows left in column c'''
+        rows = []
+        i = self.D[c]
+        while i != c:
+            rows.append(self.ROW[i])
+            i = self.D[i]
+        return rows
+
+    def columns(self):
+        '''Return the uncovered columns'''
+        cols = []
+        c = self.R[0]
+        while c != 0:
+            cols.append(c)
+            c = self.R[c]
+        return cols
+
+    def search(self, limit=None, stats=None, budget=None):
+        '''Yield each solution (as a list of rows), up to limit
+        solutions. The counts of 'nodes' and 'backtracks' are added to
+        stats, if given. If a cspbase.Budget is given, the search stops
+        when it runs out'''
+
+        if stats is None:
+            stats = {}
+        stats.setdefault('nodes', 0)
+        stats.setdefault('backtracks', 0)
+        L, R, D, C, size, ROW = self.L, self.R, self.D, self.C, self.size, self.ROW
+        chosen = []
+        found = [0]
+
+        def recurse():
+            if R[0] == 0:
+                found[0] += 1
+                yield [ROW[x] for x in chosen]
+                return
+            #the column with the fewest rows
+            c = best = R[0]
+            while c != 0:
+                if size[c] < size[best]:
+                    best = c
+                    if size[c] <= 1:
+                        break
+                c = R[c]
+            if size[best] == 0:
+                return
+            self.cover(best)
+            x = D[best]
+            while x != best:
+                if budget is not None and budget.node():
+                    return
+                stats['nodes'] += 1
+                chosen.append(x)
+                j = R[x]
+                while j != x:
+                    self.cover(C[j])
+                    j = R[j]
+                for solution in recurse():
+                    yield solution
+                    if found[0] == limit:
+                        return
+                j = L[x]
+                while j != x:
+                    self.uncover(C[j])
+                    j = L[j]
+                chosen.pop()
+                stats['backtracks'] += 1
+                x = D[x]
+            self.uncover(best)
+
+        return recurse()
+
+#The sudoku matrix
+
+def sudoku_matrix(initial_sudoku_board):
+    '''Return the ExactCover matrix of the board, with the pre-set cells
+    selected, and the candidate (i, j, value) of each row. Return None
+    for the matrix if two pre-set cells conflict'''
+
+    n = box_size(initial_sudoku_board)
+    size = n * n
+    area = size * size
+    candidates = []
+    rows = []
+    for i in range(size):
+        for j in range(size):
+            b = n * (i // n) + j // n
+            for v in range(size):
+                candidates.append((i, j, v + 1))
+                rows.append([size * i + j,
+                             area + size * i + v,
+                             2 * area + size * j + v,
+                             3 * area + size * b + v])
+    matrix = ExactCover(4 * area, rows)
+
+    #a pre-set cell selects its row; a row already removed by another
+    #pre-set cell is a conflict
+    for i, row in enumerate(initial_sudoku_board):
+        for j, value in enumerate(row):
+            if value != 0:
+                r = (size * i + j) * size + value - 1
+                x = matrix.first[r]
+                if matrix.D[matrix.U[x]] != x:
+                    return None, candidates
+                matrix.select(x)
+    return matrix, candidates
+
+def solve_dlx(initial_sudoku_board, budget=None):
+    '''Solve the board. Return (solution, stats), as sudoku_search.solve
+    (if the budget runs out, stats['incomplete'] is True)'''
+
+    stats = {'nodes': 0, 'backtracks': 0}
+    matrix, candidates = sudoku_matrix(initial_sudoku_board)
+    if matrix is None:
+        return None, stats
+    for rows in matrix.search(1, stats, budget):
+        solution = [row[:] for row in initial_sudoku_board]
+        for r in rows:
+            i, j, value = candidates[r]
+            solution[i][j] = value
+        return solution, stats
+    if budget is not None and budget.exhausted:
+        stats['incomplete'] = True
+    return None, stats
+
+def count_solutions_dlx(initial_sudoku_board, limit=None, budget=None):
+    '''Return the number of solutions of the board, counting no further
+    than limit (if given). If the budget, if given, runs out, return the
+    number found so far'''
+
+    matrix, candidates = sudoku_matrix(initial_sudoku_board)
+    if matrix is None:
+        return 0
+    return sum(1 for rows in matrix.search(limit, None, budget))
+
+def enforce_gac_dlx(initial_sudoku_board, budget=None):
+    '''Return (domains, ok): the domains of sudoku_enforce_gac_model_2 for
+    the board, computed on the exact cover matrix, and False if the board
+    was found to have no solution (the domains are then those at the
+    point of failure). If the budget, if given, runs out, the domains are
+    only partly pruned'''
+
+    n = box_size(initial_sudoku_board)
+    size = n * n
+    area = size * size
+    matrix, candidates = sudoku_matrix(initial_sudoku_board)
+    if matrix is None:
+        return [[[] for j in range(size)] for i in range(size)], False
+
+    #the cells of each unit (rows, then columns, then boxes)
+    units = [[(i, j) for j in range(size)] for i in range(size)]
+    units += [[(i, j) for i in range(size)] for j in range(size)]
+    units += [[(n * (b // n) + k // n, n * (b % n) + k % n) for k in range(size)]
+              for b in range(size)]
+
+    ok = True
+    changed = True
+    selected = []
+    while ok and changed:
+        if budget is not None and budget.check():
+            break
+        ok, changed = _select_forced(matrix, selected)
+        if ok and not changed:
+            ok, changed = _remove_hall_sets(matrix, units, size, area)
+
+    domains = [[[] for j in range(size)] for i in range(size)]
+    for i, row in enumerate(initial_sudoku_board):
+        for j, value in enumerate(row):
+            if value != 0:
+                domains[i][j].append(value)
+    for r in selected:
+        i, j, value = candidates[r]
+        domains[i][j].append(value)
+    for c in matrix.columns():
+        if c <= area:
+            #a cell column: its rows are the values left for the cell
+            for r in matrix.column_rows(c):
+                i, j, value = candidates[r]
+                domains[i][j].append(value)
+    for row in domains:
+        for d in row:
+            d.sort()
+    return domains, ok
+
+def _select_forced(matrix, selected):
+    '''Select the row of every column left with a single row, until there
+    is none, adding the rows to selected. Return (ok, changed)'''
+
+    changed = False
+    while True:
+        forced = None
+        for c in matrix.columns():
+            if matrix.size[c] == 0:
+                return False, changed
+            if matrix.size[c] == 1:
+                forced = matrix.D[c]
+                break
+        if forced is None:
+            return True, changed
+        matrix.select(forced)
+        selected.append(matrix.ROW[forced])
+        changed = True
+
+def _remove_hall_sets(matrix, units, size, area):
+    '''For each unit, remove from the cells outside each Hall set the rows
+    of the values of the Hall set. Return (ok, changed)'''
+
+    #the value bitset of each open cell (columns 1 to area are the cells)
+    open_bits = {}
+    for c in matrix.columns():
+        if c > area:
+            break
+        bits = 0
+        for r in matrix.column_rows(c):
+            bits |= 1 << (r % size)
+        open_bits[divmod(c - 1, size)] = bits
+
+    changed = False
+    for unit in units:
+        cells = [cell for cell in unit if cell in open_bits]
+        if len(cells) < 2:
+            continue
+        #the values (0 to size - 1) supported by an all-different
+        #constraint over the cells
+        scope = [Variable(str(cell), [v for v in range(size) if (open_bits[cell] >> v) & 1])
+                 for cell in cells]
+        AllDiffConstraint('unit', scope).revise()
+        if any(V.cur_domain_size() == 0 for V in scope):
+            return False, changed
+        for V, cell in zip(scope, cells):
+            bits = open_bits[cell]
+            for v in V.cur_domain():
+                bits &= ~(1 << v)
+            if not bits:
+                continue
+            i, j = cell
+            for v in range(size):
+                if (bits >> v) & 1:
+                    matrix.remove_row((size * i + j) * size + v)
+            open_bits[cell] &= ~bits
+            changed = True
+        if changed:
+            #back to the (cheaper) forced rows
+            return True, changed
+    return True, changed
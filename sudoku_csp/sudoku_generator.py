@@ -0,0 +1,234 @@
+'''Generation and grading of sudoku puzzles.
+
+   A puzzle is generated from a random solved grid (the boxes on the
+   diagonal are filled with random permutations, which never conflict,
+   and the rest is completed by solve) by removing clues, in random
+   order, as long as the board keeps a unique solution, until the target
+   number of clues is reached. As the board had a unique solution before
+   a removal, any other solution differs from the grid on a cell just
+   removed, so uniqueness is checked by searching, for each such cell,
+   for a solution with its grid value pruned (which usually fails by
+   propagation alone) rather than by counting solutions. Each search is
+   limited to MAX_CHECK_NODES nodes; a search cut short counts as finding
+   another solution, so that the clues are kept. Clues are
+   removed by orbits of the chosen SYMMETRY, so that the puzzle has that
+   symmetry:
+
+      'none'      single cells
+      'rot180'    pairs of cells symmetric about the center
+      'rot90'     cells symmetric under a quarter turn
+      'mirror'    pairs of cells symmetric about the middle column
+
+   A grid from which the target cannot be reached is dropped, and a new
+   one is tried (up to MAX_GRIDS per seed); targets much below 24 clues
+   (for 9x9 boards) are rarely reached. generate() draws seeds until it
+   has produced the puzzles asked for, and gives up (with a RuntimeError
+   after the puzzles produced) once MAX_FAILED_SEEDS seeds have failed:
+   an unreachable target costs at most MAX_GRIDS * MAX_FAILED_SEEDS
+   grids (under a second each for 9x9 boards). Given a cspbase.Budget,
+   generation also stops, after the puzzles produced, when its deadline
+   passes (each worker checks it between grids).
+
+   Puzzles are graded by the propagation they need:
+
+      'easy'      GAC with model 1 solves the board
+      'medium'    GAC with model 2 solves the board
+      'hard'      search is needed; the grade also gives the number of
+                  search nodes (with model 2 and the mrv ordering)
+
+   generate() produces puzzles on a pool of worker processes (see
+   sudoku_batch.run_many), and yields them as they are produced. Run as
+   a script to write puzzles in the one-line format of sudoku_batch,
+   each followed by its grade:
+
+   python sudoku_generator.py [--count N] [--clues N] [--symmetry none|rot180|rot90|mirror]
+                              [--size N] [--seed N] [--processes N] [--timeout S]
+'''
+
+from sudoku_batch import *
+import argparse
+import itertools
+import random
+import sys
+
+
+SYMMETRIES = ('none', 'rot180', 'rot90', 'mirror')
+
+MAX_GRIDS = 10
+
+MAX_FAILED_SEEDS = 3
+
+MAX_CHECK_NODES = 2000
+
+
+def random_grid(rng, n=3):
+    '''Return a random solved grid with boxes of dimension n'''
+
+    size = n * n
+    board = [[0] * size for i in range(size)]
+    for b in range(n):
+        values = range(1, size + 1)
+        rng.shuffle(values)
+        for k, value in enumerate(values):
+            board[n * b + k // n][n * b + k % n] = value
+    return solve(board, 2)[0]
+
+def orbit(cell, size, symmetry):
+    '''Return the set of cells that the symmetry maps cell to'''
+
+    i, j = cell
+    last = size - 1
+    if symmetry == 'none':
+        return set([(i, j)])
+    if symmetry == 'rot180':
+        return set([(i, j), (last - i, last - j)])
+    if symmetry == 'rot90':
+        return set([(i, j), (j, last - i), (last - i, last - j), (last - j, i)])
+    if symmetry == 'mirror':
+        return set([(i, j), (i, last - j)])
+    raise ValueError("unknown symmetry {}".format(symmetry))
+
+def make_puzzle(grid, clues, symmetry, rng):
+    '''Remove clues from the solved grid, by orbits of the symmetry in
+    random order, keeping the solution unique. Return the puzzle if at
+    most clues clues are left, otherwise None'''
+
+    size = len(grid)
+    board = [row[:] for row in grid]
+    cells = [(i, j) for i in range(size) for j in range(size)]
+    rng.shuffle(cells)
+    left = size * size
+
+    for cell in cells:
+        if left <= clues:
+            break
+        i, j = cell
+        if board[i][j] == 0:
+            continue
+        cells_removed = orbit(cell, size, symmetry)
+        for a, b in cells_removed:
+            board[a][b] = 0
+        if not _other_solution(board, grid, cells_removed):
+            left -= len(cells_removed)
+        else:
+            for a, b in cells_removed:
+                board[a][b] = grid[a][b]
+
+    if left > clues:
+        return None
+    return board
+
+def _other_solution(board, grid, removed):
+    '''Return True if the board has a solution differing from the grid on
+    one of the removed cells, or if a search for one was cut short'''
+
+    compiled = compiled_model(2, box_size(board))
+    for i, j in removed:
+        variables = compiled.instantiate(board)
+        variables[i][j].prune_value(grid[i][j])
+        flat = [V for row in variables for V in row]
+        budget = Budget(nodes=MAX_CHECK_NODES)
+        if mac_search(flat, compiled.constraints, 'mrv', None, compiled.var_cons, budget):
+            return True
+        if budget.exhausted:
+            return True
+    return False
+
+def grade(board):
+    '''Return the grade of the board, as a dictionary with the 'grade'
+    ('easy', 'medium' or 'hard') and the search 'nodes' needed with
+    model 2'''
+
+    n = box_size(board)
+    for model, name in ((1, 'easy'), (2, 'medium')):
+        domains = compiled_model(model, n).enforce_gac(board)
+        if all(len(d) == 1 for row in domains for d in row):
+            return {'grade': name, 'nodes': 0}
+    solution, stats = solve(board, 2, 'mrv')
+    return {'grade': 'hard', 'nodes': stats['nodes']}
+
+def generate_one(seed, clues, symmetry='rot180', n=3, budget=None):
+    '''Return a graded puzzle (board, grade) generated from the seed, or
+    None if no grid reached the target number of clues (or the budget, if
+    given, ran out first)'''
+
+    rng = random.Random(seed)
+    for attempt in range(MAX_GRIDS):
+        if budget is not None and budget.check():
+            return None
+        puzzle = make_puzzle(random_grid(rng, n), clues, symmetry, rng)
+        if puzzle is not None:
+            return puzzle, grade(puzzle)
+    return None
+
+def generate(count, clues, symmetry='rot180', n=3, seed=None, processes=None, budget=None):
+    '''Yield count graded puzzles (board, grade) with at most clues clues
+    and the given symmetry, generated on processes worker processes (by
+    default, one per CPU). Puzzles are yielded in the order of their
+    seeds, as soon as they are ready. Raise RuntimeError, after the
+    puzzles produced, if MAX_FAILED_SEEDS seeds fail to reach the target.
+    If the budget, if given, runs out, stop after the puzzles produced
+    (budget.exhausted is then True)'''
+
+    if symmetry not in SYMMETRIES:
+        raise ValueError("unknown symmetry {}".format(symmetry))
+    if seed is None:
+        seed = random.randrange(1 << 30)
+    if count <= 0:
+        return
+    produced = failed = 0
+    #seeds are drawn (a bounded number ahead, see run_many) until enough
+    #puzzles are produced
+    for result in run_many(_generate_chunk, itertools.count(seed), (clues, symmetry, n, budget),
+                           processes, 1):
+        if budget is not None and budget.check():
+            return
+        if result is None:
+            failed += 1
+            if failed == MAX_FAILED_SEEDS:
+                raise RuntimeError("only {} of {} puzzles with {} clues generated".format(
+                    produced, count, clues))
+            continue
+        yield result
+        produced += 1
+        if produced == count:
+            return
+
+#Worker function (module level, so that it can be sent to the pool)
+
+def _generate_chunk(seeds, clues, symmetry, n, budget=None):
+    return [generate_one(seed, clues, symmetry, n, budget) for seed in seeds]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate graded sudoku puzzles")
+    parser.add_argument('--count', type=int, default=10)
+    parser.add_argument('--clues', type=int, default=28,
+                        help="maximum number of clues of each puzzle")
+    parser.add_argument('--symmetry', choices=SYMMETRIES, default='rot180')
+    parser.add_argument('--size', type=int, default=3,
+                        help="box dimension (3 for 9x9 boards)")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--processes', '-j', type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument('--timeout', type=float, default=None,
+                        help="seconds allowed for the whole generation")
+    options = parser.parse_args(argv)
+
+    budget = None if options.timeout is None else Budget(seconds=options.timeout)
+    produced = 0
+    try:
+        for board, graded in generate(options.count, options.clues, options.symmetry,
+                                      options.size, options.seed, options.processes, budget):
+            sys.stdout.write("{} {} {}\n".format(format_board(board), graded['grade'], graded['nodes']))
+            sys.stdout.flush()
+            produced += 1
+    except RuntimeError as e:
+        sys.stderr.write("{}\n".format(e))
+        return 1
+    if produced < options.count:
+        sys.stderr.write("only {} of {} puzzles with {} clues generated in {} seconds\n".format(
+            produced, options.count, options.clues, options.timeout))
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,225 @@
+'''Propagation at selectable strength LEVELS.
+
+   Full GAC is more inference than most boards need. propagate() runs a
+   list of inference rules on the variables of the compiled model 2, from
+   the cheapest to the strongest allowed by the level, going back to the
+   cheapest rule whenever a stronger one prunes something, until no rule
+   prunes anything:
+
+      'singles'   naked singles: the value of a cell with a single value is
+                  removed from the other cells of its units. This is GAC on
+                  model 1 (sudoku_enforce_gac_model_1).
+      'hidden'    + hidden singles: a value that fits in a single cell of
+                  a unit is assigned to that cell.
+      'subsets'   + naked subsets: if k cells of a unit (k = 2 to
+                  MAX_SUBSET) have k values between them, those values are
+                  removed from the other cells of the unit.
+      'gac'       + GAC on the all-different constraints of the units. This
+                  is sudoku_enforce_gac_model_2.
+      'sac'       + singleton arc consistency: a value is removed if
+                  assigning it makes GAC fail.
+
+   The rules work on the integer bitsets of the current domains. Each
+   rule returns None if it finds that the board has no solution, and
+   otherwise whether it pruned anything.
+
+   Given a cspbase.Budget, propagation stops when it runs out (between
+   rules, or within the GAC and SAC rules), with the domains pruned so
+   far.
+'''
+
+from sudoku_csp import *
+from cspbase import _bit_positions, _popcount
+import itertools
+
+
+LEVELS = ('singles', 'hidden', 'subsets', 'gac', 'sac')
+
+MAX_SUBSET = 4
+
+
+def propagate(initial_sudoku_board, level='gac', budget=None):
+    '''Prune the domains of the board with the rules of the given level.
+    Return a pair (domains, ok): the pruned domains, in the format of
+    sudoku_enforce_gac_model_1, and False if the board was found to have
+    no solution. If the budget, if given, runs out, the domains are only
+    partly pruned (and budget.exhausted is True)'''
+
+    if level not in LEVELS:
+        raise ValueError("unknown propagation level {}".format(level))
+    rules = RULES[:LEVELS.index(level) + 1]
+
+    compiled = compiled_model(2, box_size(initial_sudoku_board))
+    variables = compiled.instantiate(initial_sudoku_board)
+    state = _State(compiled, budget)
+
+    with profile_phase('propagation'):
+        ok = _fixpoint(state, rules)
+    return cur_domains(variables), ok
+
+def _fixpoint(state, rules):
+    '''Run the rules, cheapest first, until none prunes anything. Return
+    False if one finds that there is no solution'''
+
+    i = 0
+    while i < len(rules):
+        if state.budget is not None and state.budget.check():
+            break
+        changed = rules[i](state)
+        if changed is None:
+            return False
+        if changed and i > 0:
+            i = 0
+        else:
+            i += 1
+    return True
+
+class _State(object):
+    '''The variables and units of a compiled model 2, the cells whose
+    single value has already been removed from their peers, and the
+    budget of the propagation'''
+
+    def __init__(self, compiled, budget=None):
+        self.compiled = compiled
+        self.budget = budget
+        self.variables = [V for row in compiled.variables for V in row]
+        self.units = [C.scope for C in compiled.constraints]
+        self.peers = compiled.peers
+        self.done = set()
+
+#Rules
+
+def _naked_singles(state):
+    stack = [V for V in state.variables if V.cur_domain_size() == 1 and V not in state.done]
+    changed = False
+    while stack:
+        V = stack.pop()
+        if V in state.done:
+            continue
+        state.done.add(V)
+        bits = V.cur_domain_bits()
+        value = V.dom[_lowest(bits)]
+        for P in state.peers[V]:
+            if P.cur_domain_bits() & bits:
+                P.prune_value(value)
+                changed = True
+                size = P.cur_domain_size()
+                if size == 0:
+                    return None
+                if size == 1:
+                    stack.append(P)
+    return changed
+
+def _hidden_singles(state):
+    changed = False
+    for unit in state.units:
+        once = twice = 0
+        for V in unit:
+            bits = V.cur_domain_bits()
+            twice |= once & bits
+            once |= bits
+        if once != (1 << len(unit)) - 1:
+            #a value fits in no cell of the unit
+            return None
+        single = once & ~twice
+        if not single:
+            continue
+        for V in unit:
+            bits = V.cur_domain_bits() & single
+            if bits and V.cur_domain_size() > 1:
+                if bits & (bits - 1):
+                    #two values that each fit only in this cell
+                    return None
+                _keep(V, bits)
+                changed = True
+    return changed
+
+def _naked_subsets(state):
+    changed = False
+    for unit in state.units:
+        for k in range(2, MAX_SUBSET + 1):
+            open_cells = [V for V in unit if 1 < V.cur_domain_size() <= k]
+            if len(open_cells) < k:
+                continue
+            for subset in itertools.combinations(open_cells, k):
+                union = 0
+                for V in subset:
+                    union |= V.cur_domain_bits()
+                size = _popcount(union)
+                if size < k:
+                    return None
+                if size > k:
+                    continue
+                for V in unit:
+                    bits = V.cur_domain_bits()
+                    if V not in subset and bits & union:
+                        _keep(V, bits & ~union)
+                        if V.cur_domain_size() == 0:
+                            return None
+                        changed = True
+    return changed
+
+def _gac(state):
+    '''GAC on the units. The cheaper rules are at their fixpoint when
+    this rule runs: a Hall set of a unit with at most MAX_SUBSET + 1 open
+    cells has at most MAX_SUBSET cells, and has been found by
+    _naked_subsets, so only the larger units are revised first'''
+
+    compiled = state.compiled
+    before = _size(state.variables)
+    initial = [C for C in compiled.constraints
+               if sum(1 for V in C.scope if V.cur_domain_size() > 1) > MAX_SUBSET + 1]
+    if not enforce_gac(compiled.constraints, compiled.var_cons, initial, budget=state.budget):
+        return None
+    return _size(state.variables) < before
+
+def _sac(state):
+    '''Remove the values whose assignment makes GAC fail. The domains are
+    GAC when this rule runs (it comes after _gac)'''
+
+    compiled = state.compiled
+    trail = Trail(state.variables)
+    trail.attach(compiled.constraints)
+    changed = False
+    try:
+        for V in state.variables:
+            if V.cur_domain_size() == 1:
+                continue
+            for value in V.cur_domain():
+                trail.push_level()
+                V.assign(value)
+                ok = enforce_gac(compiled.constraints, compiled.var_cons,
+                                 compiled.var_cons.get(V, []), budget=state.budget)
+                trail.pop_level()
+                if state.budget is not None and state.budget.exhausted:
+                    return changed
+                if not ok:
+                    V.prune_value(value)
+                    changed = True
+                    if V.cur_domain_size() == 0:
+                        return None
+            if changed:
+                #let the cheaper rules use the pruning first
+                return True
+    finally:
+        for V in state.variables:
+            V.trail = None
+        for C in compiled.constraints:
+            C.trail = None
+    return changed
+
+RULES = [_naked_singles, _hidden_singles, _naked_subsets, _gac, _sac]
+
+#Helper functions
+
+def _keep(V, bits):
+    '''Prune from V the values not in bits'''
+
+    for j in _bit_positions(V.cur_domain_bits() & ~bits):
+        V.prune_value(V.dom[j])
+
+def _lowest(bits):
+    return (bits & -bits).bit_length() - 1
+
+def _size(variables):
+    return sum(V.cur_domain_size() for V in variables)
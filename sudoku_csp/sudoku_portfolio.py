@@ -0,0 +1,256 @@
+'''Portfolio solving: several configurations raced on the same board.
+
+   The time a search takes on a hard board depends much on its
+   configuration, and the fastest one differs from board to board.
+   solve_portfolio() and count_portfolio() run a list of CONFIGURATIONS
+   on the board at the same time, each in its own process, take the
+   result of the first to finish and terminate the others. The worst
+   case is then that of the best configuration for each board, rather
+   than that of a fixed one. A configuration is a dictionary with an
+   'engine':
+
+      {'engine': 'mac', 'model': 1 or 2, 'ordering': 'mrv' or 'domwdeg',
+       'seed': None or a number}
+                  sudoku_search: MAC search. With a seed, the search runs on
+                  the board transformed by a random sudoku symmetry (digit
+                  relabeling, permutations of the bands and stacks, of the
+                  rows and columns within them, and transposition), which
+                  changes the order in which it meets the cells and values,
+                  and the solution is transformed back
+      {'engine': 'dlx'}
+                  sudoku_dlx: exact cover search
+      {'engine': 'learning'}
+                  sudoku_learning: search with nogood learning and
+                  restarts (it cannot count solutions)
+
+   configurations(count) returns a default portfolio of count
+   configurations, different engines first and then seeded variants.
+
+   COUNTING: every engine counts the same solutions (the symmetries map
+   the solutions of the board to those of the transformed board), so the
+   count of the first configuration to complete is the count. The
+   learning engine is left out. A count cut short by the deadline is
+   only a lower bound: it never wins, and if no configuration completes,
+   the largest one is returned, with stats['incomplete'] set.
+
+   Given a cspbase.Budget, each process runs with a copy of it (the same
+   deadline, and the nodes and revisions left), and the portfolio
+   returns when its deadline passes or it is cancelled; if the result is
+   incomplete, budget.exhausted is set. A process that dies without
+   reporting (e.g., killed for lack of memory) counts as an incomplete
+   result. The compiled models are built before the processes are
+   started, so that they inherit them.
+'''
+
+from sudoku_batch import *
+from sudoku_learning import solve_learning
+from sudoku_dlx import solve_dlx, count_solutions_dlx
+from sudoku_cache import random_transform
+import Queue
+import argparse
+import multiprocessing
+import random
+import sys
+import time
+
+
+ENGINES = ('mac', 'dlx', 'learning')
+
+#Time allowed to the processes to report past the deadline
+GRACE = 0.5
+
+#Seconds between checks that the processes are still alive
+POLL = 0.05
+
+#The engines first, then MAC on model 2 with random symmetries
+DEFAULT_CONFIGURATIONS = [
+    {'engine': 'mac', 'model': 2, 'ordering': 'mrv', 'seed': None},
+    {'engine': 'learning'},
+    {'engine': 'dlx'},
+    {'engine': 'mac', 'model': 2, 'ordering': 'domwdeg', 'seed': None},
+    {'engine': 'mac', 'model': 1, 'ordering': 'domwdeg', 'seed': None},
+]
+
+
+def configurations(count=None):
+    '''Return a portfolio of count configurations (by default, one per
+    CPU)'''
+
+    if count is None:
+        count = multiprocessing.cpu_count()
+    configs = DEFAULT_CONFIGURATIONS[:count]
+    for seed in range(1, count - len(configs) + 1):
+        configs.append({'engine': 'mac', 'model': 2, 'ordering': 'mrv', 'seed': seed})
+    return configs
+
+def solve_portfolio(initial_sudoku_board, configs=None, budget=None):
+    '''Solve the board with the configurations in parallel. Return
+    (solution, stats) as sudoku_search.solve, from the first
+    configuration to finish; stats['configuration'] is that
+    configuration. If the board has several solutions, which one is
+    returned depends on the winner. If the budget runs out first,
+    solution is None and stats['incomplete'] is True'''
+
+    if configs is None:
+        configs = configurations()
+    return _race('solve', initial_sudoku_board, None, configs, budget)
+
+def count_portfolio(initial_sudoku_board, limit=None, configs=None, budget=None, stats=None):
+    '''Return the number of solutions of the board, counting no further
+    than limit (if given), from the first configuration able to count to
+    finish (stats['configuration'], if stats is given). If the budget
+    runs out first, return the largest number found so far and set
+    stats['incomplete']'''
+
+    if configs is None:
+        configs = configurations()
+    configs = [config for config in configs if config['engine'] != 'learning']
+    if not configs:
+        raise ValueError("no configuration of the portfolio can count solutions")
+    count, result_stats = _race('count', initial_sudoku_board, limit, configs, budget)
+    if stats is not None:
+        stats.update(result_stats)
+    return count
+
+def _race(op, board, limit, configs, budget):
+    '''Run op on the board with each configuration in its own process.
+    Return the (result, stats) of the first complete one, or the best
+    incomplete one if none completes'''
+
+    for config in configs:
+        if config['engine'] not in ENGINES:
+            raise ValueError("unknown engine {}".format(config['engine']))
+
+    #built once here, inherited by the forked processes
+    n = box_size(board)
+    for model in set(config.get('model', 1) for config in configs):
+        compiled_model(model, n)
+    deadline = None if budget is None else budget.deadline
+
+    #each process gets a copy of the budget
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_run_configuration,
+                                       args=(results, k, op, board, limit, config, budget))
+               for k, config in enumerate(configs)]
+    best = None
+    finished = set()
+    try:
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        while True:
+            if deadline is not None and time.time() > deadline + GRACE:
+                break
+            if budget is not None and budget.cancelled:
+                break
+            try:
+                k, result, stats = results.get(timeout=POLL)
+            except Queue.Empty:
+                #a process that exited normally has put its result (still
+                #to be read); one that failed never will
+                for k, worker in enumerate(workers):
+                    if worker.exitcode not in (None, 0):
+                        finished.add(k)
+                if len(finished) == len(workers):
+                    break
+                continue
+            finished.add(k)
+            stats['configuration'] = configs[k]
+            if not stats.get('incomplete'):
+                best = (result, stats)
+                break
+            if op == 'count' and (best is None or result > best[0]):
+                best = (result, stats)
+    finally:
+        #cancel the losers
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in workers:
+            worker.join()
+
+    if best is None:
+        best = (None if op == 'solve' else 0, {'incomplete': True})
+    if budget is not None and best[1].get('incomplete'):
+        budget.exhausted = True
+    return best
+
+#Worker function (module level, so that it can be the target of a process)
+
+def _run_configuration(results, k, op, board, limit, config, budget):
+    try:
+        result, stats = _run(op, board, limit, config, budget)
+    except Exception as e:
+        #reported as an incomplete result, so that the race goes on
+        result, stats = None if op == 'solve' else 0, {'incomplete': True, 'error': str(e)}
+    results.put((k, result, stats))
+
+def _run(op, board, limit, config, budget):
+    engine = config['engine']
+    transform = None
+    if config.get('seed') is not None:
+        transform = random_transform(box_size(board), random.Random(config['seed']))
+        board = transform.apply(board)
+
+    stats = {}
+    if engine == 'mac':
+        if op == 'solve':
+            result, stats = solve(board, config['model'], config['ordering'], budget)
+        else:
+            result = count_solutions(board, limit, config['model'], config['ordering'], stats, budget)
+    elif engine == 'dlx':
+        if op == 'solve':
+            result, stats = solve_dlx(board, budget)
+        else:
+            result = count_solutions_dlx(board, limit, budget)
+            if budget is not None and budget.exhausted:
+                stats['incomplete'] = True
+    else:
+        result, stats = solve_learning(board, budget=budget)
+
+    if op == 'solve' and result is not None and transform is not None:
+        result = transform.inverse().apply(result)
+    return result, stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve sudoku boards with a portfolio of parallel searches")
+    parser.add_argument('input', nargs='?', default='-',
+                        help="file of boards, one per line (default: standard input)")
+    parser.add_argument('--count', action='store_true',
+                        help="count the solutions instead of solving")
+    parser.add_argument('--limit', type=int, default=None,
+                        help="count no further than this number of solutions")
+    parser.add_argument('--configurations', '-j', type=int, default=None,
+                        help="number of configurations raced (default: one per CPU)")
+    parser.add_argument('--timeout', type=float, default=None,
+                        help="seconds allowed for each board")
+    options = parser.parse_args(argv)
+
+    configs = configurations(options.configurations)
+    stream = sys.stdin if options.input == '-' else open(options.input)
+    for board in read_boards(stream):
+        start = time.time()
+        budget = None if options.timeout is None else Budget(seconds=options.timeout)
+        if options.count:
+            stats = {}
+            result = count_portfolio(board, options.limit, configs, budget, stats)
+        else:
+            solution, stats = solve_portfolio(board, configs, budget)
+            result = '-' if solution is None else format_board(solution)
+        sys.stdout.write("{} {} {:.3f}s {}{}\n".format(
+            result, _describe(stats.get('configuration')), time.time() - start,
+            stats.get('nodes', '-'), " incomplete" if stats.get('incomplete') else ""))
+        sys.stdout.flush()
+
+def _describe(config):
+    if config is None:
+        return '-'
+    if config['engine'] != 'mac':
+        return config['engine']
+    name = "mac{}-{}".format(config['model'], config['ordering'])
+    if config.get('seed') is not None:
+        name += "-{}".format(config['seed'])
+    return name
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+'''Backtracking search over the sudoku CSP models.
+
+   solve() completes a board by maintained arc consistency (MAC): at each
+   node of the search one unassigned variable is assigned a value, and GAC
+   is enforced (with enforce_gac) on the constraints of that variable
+   before going deeper. The changes made to the variable domains are
+   recorded on a Trail and undone when backtracking, and the model itself
+   is the CompiledModel shared by every board, so nothing is rebuilt.
+
+   The variable to assign is chosen by one of the ORDERINGS:
+
+      'mrv'      minimum remaining values: smallest current domain.
+
+      'domwdeg'  dom/wdeg: smallest ratio of current domain size to the
+                 total weight of the constraints of the variable that
+                 still involve another unassigned variable. The weight of
+                 a constraint is incremented each time it causes a domain
+                 wipe out, so the search focuses on the hard part of the
+                 board.
+
+   count_solutions() runs the same search without stopping at the first
+   solution, up to a given number of solutions; is_unique() stops at the
+   second one.
+'''
+
+from sudoku_csp import *
+
+
+def solve(initial_sudoku_board, model=1, ordering='mrv', budget=None):
+    '''Solve the board (a list of lists, in the format used by
+       sudoku_enforce_gac_model_1) using the constraints of model 1 or
+       model 2, and the given variable ordering ('mrv' or 'domwdeg').
+
+       Return a pair (solution, stats). solution is the completed board,
+       as a list of lists of numbers, or None if the board has no
+       solution. stats is a dictionary with the number of search 'nodes'
+       (assignments tried) and 'backtracks' (assignments undone).
+
+       If a cspbase.Budget is given and runs out before the search is
+       done, solution is None, stats['incomplete'] is True, and
+       stats['domains'] gives the domains propagated before the search
+       (as returned by sudoku_enforce_gac_model_1, and only partly pruned
+       if the budget ran out during that propagation).'''
+
+    compiled = compiled_model(model, box_size(initial_sudoku_board))
+    variables = compiled.instantiate(initial_sudoku_board)
+    flat = [V for row in variables for V in row]
+    stats = {}
+
+    with profile_phase('search'):
+        found = mac_search(flat, compiled.constraints, ordering, stats, compiled.var_cons, budget)
+    if stats.get('incomplete'):
+        stats['domains'] = cur_domains(variables)
+        return None, stats
+    if not found:
+        return None, stats
+
+    solution = [[V.cur_domain()[0] for V in row] for row in variables]
+    return solution, stats
+
+def count_solutions(initial_sudoku_board, limit=None, model=2, ordering='mrv', stats=None,
+                    budget=None):
+    '''Return the number of solutions of the board, counting no further
+       than limit (if given) so that the search stops as soon as limit
+       solutions are found. GAC with the constraints of model 1 or model 2
+       is enforced at every node. The search counts are added to stats (a
+       dictionary), if given.
+
+       If a cspbase.Budget is given and runs out, the number of solutions
+       found so far is returned (a lower bound), and budget.exhausted
+       (and stats['incomplete']) is True.'''
+
+    compiled = compiled_model(model, box_size(initial_sudoku_board))
+    variables = compiled.instantiate(initial_sudoku_board)
+    flat = [V for row in variables for V in row]
+
+    with profile_phase('search'):
+        return mac_count(flat, compiled.constraints, limit, ordering, stats, compiled.var_cons,
+                         budget)
+
+def is_unique(initial_sudoku_board, model=2, budget=None):
+    '''Return True iff the board has exactly one solution (the search
+       stops at the second solution). If a cspbase.Budget is given and
+       runs out, return None'''
+
+    count = count_solutions(initial_sudoku_board, 2, model, budget=budget)
+    if budget is not None and budget.exhausted:
+        return None
+    return count == 1
+
+def mac_search(variables, constraints, ordering='mrv', stats=None, var_cons=None, budget=None):
+    '''Search for an assignment of the variables satisfying the
+       constraints, enforcing GAC after every assignment. Return True if
+       one is found, in which case every variable is left with a single
+       value in its current domain. Otherwise return False, leaving the
+       current domains as they were after the initial propagation.
+
+       The search counts are added to stats (a dictionary), if given.
+       var_cons is the GAC_index of the constraints, built if not given.
+
+       If a cspbase.Budget is given and runs out, the search stops: False
+       is returned, stats['incomplete'] is set to True, and the current
+       domains are left as they were after the initial propagation.'''
+
+    return mac_count(variables, constraints, 1, ordering, stats, var_cons, budget) == 1
+
+def mac_count(variables, constraints, limit=None, ordering='mrv', stats=None, var_cons=None,
+              budget=None):
+    '''Count the assignments of the variables satisfying the constraints,
+       as mac_search, up to limit (if given). If limit is reached, the
+       variables are left with the values of the last solution found;
+       otherwise the current domains are left as they were after the
+       initial propagation. The arguments are as for mac_search.'''
+
+    if ordering not in ORDERINGS:
+        raise ValueError("unknown variable ordering {}".format(ordering))
+    select = ORDERINGS[ordering]
+
+    if stats is None:
+        stats = {}
+    stats.setdefault('nodes', 0)
+    stats.setdefault('backtracks', 0)
+
+    #constraints with reversible state of their own record it on the
+    #same trail as the variables
+    trail = Trail(variables)
+    trail.attach(constraints)
+    try:
+        if var_cons is None:
+            var_cons = GAC_index(constraints)
+        weights = dict((C, 1) for C in constraints)
+
+        if not enforce_gac(constraints, var_cons, weights=weights, budget=budget):
+            return 0
+        if budget is not None and budget.exhausted:
+            stats['incomplete'] = True
+            return 0
+
+        count = [0]
+
+        def search():
+            '''Return True when the limit is reached (or the budget has run
+            out)'''
+            if budget is not None and budget.node():
+                return True
+            unassigned = [V for V in variables if V.cur_domain_size() > 1]
+            if len(unassigned) == 0:
+                #GAC holds with every domain a single value: a solution
+                count[0] += 1
+                return count[0] == limit
+
+            V = select(unassigned, var_cons, weights)
+            for d in V.cur_domain():
+                stats['nodes'] += 1
+                trail.push_level()
+
+                V.assign(d)
+
+                if enforce_gac(constraints, var_cons, var_cons.get(V, []), weights, budget) and search():
+                    return True
+
+                trail.pop_level()
+                stats['backtracks'] += 1
+
+            return False
+
+        search()
+        if budget is not None and budget.exhausted:
+            #back to the state after the initial propagation
+            trail.restore_level(0)
+            stats['incomplete'] = True
+        return count[0]
+    finally:
+        #stop recording on the trail of this search (instantiate only
+        #resets the variables, and constraints would keep recording)
+        for V in variables:
+            V.trail = None
+        for C in constraints:
+            C.trail = None
+
+#Variable ordering heuristics
+
+def select_mrv(unassigned, var_cons, weights):
+    '''Return the unassigned variable with the smallest current domain'''
+
+    return min(unassigned, key=lambda V: V.cur_domain_size())
+
+def select_domwdeg(unassigned, var_cons, weights):
+    '''Return the unassigned variable with the smallest ratio of current
+    domain size to weighted degree'''
+
+    def wdeg(V):
+        w = 0
+        for C in var_cons.get(V, []):
+            for other in C.scope:
+                if other is not V and other.cur_domain_size() > 1:
+                    w += weights[C]
+                    break
+        return w
+
+    return min(unassigned, key=lambda V: float(V.cur_domain_size()) / max(wdeg(V), 1))
+
+ORDERINGS = {'mrv': select_mrv, 'domwdeg': select_domwdeg}
@@ -0,0 +1,583 @@
+'''A local solving service speaking JSON lines over TCP or a Unix socket.
+
+   Each request is a JSON object on a line of its own:
+
+      {"id": 1, "board": "0020900600...", "op": "gac", "model": 2}
+
+   board is a board in the one-line format of sudoku_batch, or a list of
+   lists; op is "gac" (the default: the domains of model 1 or 2) or
+   "solve" (with an optional "ordering"); "timeout" overrides the
+   server's timeout, in seconds. The response, on a line of its own,
+   repeats the id and gives the "domains", or the "solution" (null if
+   there is none) and search "stats", or an "error". Responses are
+   written as soon as they are ready, so a client sending several
+   requests on one connection may get them back in another order. The
+   request {"op": "metrics"} returns the metrics of the server.
+
+   Each connection has a thread of its own writing its responses, so
+   that the service never waits for (or fails with) a slow or closed
+   client. When a connection is closed, or a write to it fails, its
+   requests not yet answered are cancelled: they are dropped from the
+   queue, and their running work stops at its timeout.
+
+   Requests from every connection go to a SolverService, which:
+
+      - groups them into micro-batches (up to batch_size requests, or the
+        requests that arrived within batch_delay seconds of the first)
+      - runs each batch on a pool of worker processes started with the
+        server, which build the compiled models before the first request
+      - keeps at most 2 batches per worker in flight, and rejects new
+        requests with an "overloaded" error while max_pending requests
+        are waiting or running (backpressure)
+      - stops the work on a request at its timeout (see cspbase.Budget),
+        answering with the partial result, flagged "incomplete": true (for
+        "solve", the propagated but unsolved "domains"); a request still
+        queued at its timeout, or not answered by its worker soon after,
+        gets a "timeout" error
+      - gives up on a batch that fails in its worker, or is still
+        running past its deadline (its worker died or hangs): its slot is
+        freed, and in the second case the pool is replaced by a new one,
+        the other batches of the old pool being queued again
+      - counts requests, batches, rejections, timeouts, cancellations,
+        errors and pool restarts, and keeps the latencies of recent requests for percentiles
+
+   (The service runs on threads, as this code base predates asyncio.)
+
+   Run as a script to serve, or with --client to send the boards of a
+   file (one per line) to a running server and print the responses:
+
+   python sudoku_server.py (--tcp HOST:PORT | --unix PATH) [--processes N]
+                           [--batch-size N] [--batch-delay S] [--max-pending N]
+                           [--timeout S] [--client FILE [--op gac|solve] [--model 1|2]]
+'''
+
+from sudoku_batch import *
+from collections import deque
+import Queue
+import SocketServer
+import argparse
+import json
+import multiprocessing
+import socket
+import sys
+import threading
+import time
+
+
+class _Request(object):
+    '''A request waiting for its response'''
+
+    __slots__ = ('payload', 'respond', 'owner', 'received', 'deadline', 'done')
+
+    def __init__(self, payload, respond, owner, received, deadline):
+        self.payload = payload
+        self.respond = respond
+        self.owner = owner
+        self.received = received
+        self.deadline = deadline
+        self.done = False
+
+
+class _Batch(object):
+    '''A batch of requests sent to the pool'''
+
+    __slots__ = ('requests', 'deadline', 'result')
+
+    def __init__(self, requests, deadline):
+        self.requests = requests
+        self.deadline = deadline        #when to give up on it
+        self.result = None              #the AsyncResult of the pool
+
+
+class SolverService(object):
+    '''Micro-batching front end to a pool of warm worker processes (see
+    the module documentation)'''
+
+    #seconds after its deadline before a running request gets a timeout
+    GRACE = 0.5
+
+    def __init__(self, processes=None, batch_size=32, batch_delay=0.002,
+                 max_pending=1024, timeout=10.0):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_pending = max_pending
+        self.timeout = timeout
+
+        #the pool is started before any thread, so that the workers are
+        #forked from a single threaded process
+        self.pool = multiprocessing.Pool(processes, _warm)
+        self.max_batches = 2 * processes
+
+        self.lock = threading.Condition()
+        self.queue = deque()            #requests not yet sent to the pool
+        self.running = set()            #requests sent to the pool
+        self.batches = set()            #batches sent to the pool
+        self.latencies = deque(maxlen=10000)
+        self.counters = dict((name, 0) for name in
+                             ('received', 'completed', 'incomplete', 'errors', 'timeouts',
+                              'rejected', 'cancelled', 'batches', 'restarts'))
+        self.started = time.time()
+        self.closed = False
+
+        self.thread = threading.Thread(target=self._batcher)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, payload, respond, owner=None):
+        '''Queue a request (a dictionary, see the module documentation).
+        respond is called exactly once, from some thread, with the
+        response dictionary, unless the request is cancelled (see
+        cancel). respond must not block'''
+
+        now = time.time()
+        try:
+            timeout = float(payload.get('timeout', self.timeout))
+            if not timeout > 0:
+                raise ValueError("timeout must be positive")
+        except (TypeError, ValueError) as e:
+            with self.lock:
+                self.counters['received'] += 1
+                self.counters['errors'] += 1
+            respond(_error(payload, "invalid request: {}".format(e)))
+            return
+        request = _Request(payload, respond, owner, now, now + timeout)
+        with self.lock:
+            self.counters['received'] += 1
+            if self.closed or len(self.queue) + len(self.running) >= self.max_pending:
+                self.counters['rejected'] += 1
+                request.done = True
+            else:
+                self.queue.append(request)
+                self.lock.notify()
+                return
+        respond(_error(payload, "overloaded"))
+
+    def cancel(self, owner):
+        '''Cancel the requests of owner (given to submit) not yet
+        answered: they get no response. Requests sent to the pool still
+        run, up to their timeout'''
+
+        with self.lock:
+            for request in self.queue:
+                if request.owner is owner and not request.done:
+                    request.done = True
+                    self.counters['cancelled'] += 1
+            self.queue = deque(r for r in self.queue if not r.done)
+            for request in list(self.running):
+                if request.owner is owner:
+                    request.done = True
+                    self.running.discard(request)
+                    self.counters['cancelled'] += 1
+
+    def metrics(self):
+        '''Return the counters, current queue sizes, throughput and
+        latency percentiles (in seconds) of the service'''
+
+        with self.lock:
+            result = dict(self.counters)
+            result['queued'] = len(self.queue)
+            result['running'] = len(self.running)
+            result['running_batches'] = len(self.batches)
+            latencies = sorted(self.latencies)
+        elapsed = time.time() - self.started
+        result['uptime'] = elapsed
+        result['throughput'] = result['completed'] / elapsed if elapsed > 0 else 0.0
+        answered = result['completed'] + result['incomplete'] + result['errors']
+        result['mean_batch'] = (float(answered) / result['batches']
+                                if result['batches'] else 0.0)
+        for p in (50, 95, 99):
+            key = 'latency_p{}'.format(p)
+            result[key] = latencies[min(len(latencies) - 1, len(latencies) * p // 100)] if latencies else None
+        return result
+
+    def close(self):
+        '''Stop accepting requests and stop the worker processes'''
+
+        with self.lock:
+            self.closed = True
+            self.lock.notify()
+        self.pool.terminate()
+        self.pool.join()
+
+    def _finish(self, request, response, counter):
+        '''Send the response of request, unless it was already sent'''
+
+        with self.lock:
+            if request.done:
+                return
+            request.done = True
+            self.running.discard(request)
+            self.counters[counter] += 1
+            if counter == 'completed':
+                self.latencies.append(time.time() - request.received)
+        request.respond(response)
+
+    def _expire(self, now):
+        '''Answer the requests whose deadline has passed'''
+
+        with self.lock:
+            #running requests stop at their deadline by themselves: only
+            #give up on them (e.g., a stuck worker) after a grace period
+            expired = [r for r in self.running if r.deadline + self.GRACE <= now]
+            expired += [r for r in self.queue if r.deadline <= now]
+        for request in expired:
+            self._finish(request, _error(request.payload, "timeout"), 'timeouts')
+
+    def _check_batches(self, now):
+        '''Give up on the batches that failed in their worker (the pool
+        then never calls back), and on those still running past their
+        deadline, whose worker died or hangs: the pool is then replaced,
+        and its other batches are queued again'''
+
+        with self.lock:
+            failed = [b for b in self.batches if b.result.ready() and not b.result.successful()]
+            stuck = [b for b in self.batches if b.deadline <= now and not b.result.ready()]
+            if not failed and not stuck:
+                return
+            self.batches.difference_update(failed + stuck)
+            if stuck:
+                for batch in self.batches:
+                    for request in reversed(batch.requests):
+                        if not request.done:
+                            self.running.discard(request)
+                            self.queue.appendleft(request)
+                self.batches.clear()
+                self.counters['restarts'] += 1
+            self.lock.notify()
+
+        for batch in failed:
+            try:
+                batch.result.get(0)
+            except Exception as e:
+                message = "internal error: {}".format(e)
+            for request in batch.requests:
+                self._finish(request, _error(request.payload, message), 'errors')
+        if stuck:
+            for batch in stuck:
+                for request in batch.requests:
+                    self._finish(request, _error(request.payload, "timeout"), 'timeouts')
+            #only this thread sends batches to the pool
+            old, self.pool = self.pool, multiprocessing.Pool(self.processes, _warm)
+            old.terminate()
+
+    def _batcher(self):
+        '''Collect batches of requests and send them to the pool'''
+
+        while True:
+            with self.lock:
+                while not self.queue and not self.closed:
+                    #wake up regularly to expire running requests
+                    self.lock.wait(0.05)
+                    if self.running or self.batches:
+                        break
+                if self.closed:
+                    return
+            self._expire(time.time())
+            self._check_batches(time.time())
+
+            with self.lock:
+                if not self.queue:
+                    continue
+                first = self.queue[0].received
+            #wait for more requests, up to the batch size or delay
+            delay = first + self.batch_delay - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            #wait for a free slot, still expiring requests meanwhile
+            while True:
+                with self.lock:
+                    if self.closed:
+                        return
+                    if len(self.batches) < self.max_batches:
+                        break
+                    self.lock.wait(0.05)
+                self._expire(time.time())
+                self._check_batches(time.time())
+            with self.lock:
+                requests = []
+                while self.queue and len(requests) < self.batch_size:
+                    request = self.queue.popleft()
+                    if not request.done:
+                        requests.append(request)
+                        self.running.add(request)
+                if not requests:
+                    continue
+                self.counters['batches'] += 1
+                #the workers stop at the deadline of each request
+                batch = _Batch(requests, max(r.deadline for r in requests) + self.GRACE)
+                self.batches.add(batch)
+
+            payloads = [dict(r.payload, deadline=r.deadline) for r in requests]
+            batch.result = self.pool.apply_async(
+                _run_batch, (payloads,),
+                callback=lambda results, batch=batch: self._done(batch, results))
+
+    def _done(self, batch, results):
+        with self.lock:
+            if batch not in self.batches:
+                #given up on (see _check_batches)
+                return
+            self.batches.discard(batch)
+            self.lock.notify()
+        for request, response in zip(batch.requests, results):
+            if response.get('incomplete'):
+                self._finish(request, response, 'incomplete')
+            elif 'error' in response:
+                self._finish(request, response, 'errors')
+            else:
+                self._finish(request, response, 'completed')
+
+def _error(payload, message):
+    return {'id': payload.get('id'), 'error': message}
+
+#Worker functions (module level, so that they can be sent to the pool)
+
+def _warm():
+    '''Build the compiled models of 9x9 boards in a new worker'''
+    compiled_model(1)
+    compiled_model(2)
+
+def _run_batch(payloads):
+    return [_run_one(payload) for payload in payloads]
+
+def _run_one(payload):
+    try:
+        board = payload['board']
+        if isinstance(board, basestring):
+            board = parse_board(board)
+        model = payload.get('model', 1)
+        op = payload.get('op', 'gac')
+        budget = Budget(seconds=payload['deadline'] - time.time())
+        if op == 'gac':
+            response = {'id': payload.get('id'),
+                        'domains': compiled_model(model, box_size(board)).enforce_gac(board, budget)}
+        elif op == 'solve':
+            solution, stats = solve(board, model, payload.get('ordering', 'mrv'), budget)
+            if solution is not None:
+                solution = format_board(solution)
+            response = {'id': payload.get('id'), 'solution': solution, 'stats': stats}
+            if 'domains' in stats:
+                response['domains'] = stats.pop('domains')
+        else:
+            return _error(payload, "unknown op {}".format(op))
+        if budget.exhausted:
+            response['incomplete'] = True
+        return response
+    except (KeyError, TypeError, ValueError) as e:
+        return _error(payload, "invalid request: {}".format(e))
+    except Exception as e:
+        return _error(payload, "internal error: {}".format(e))
+
+#The socket server
+
+class _Connection(object):
+    '''The responses of a connection: queued by any thread (respond never
+    blocks), and written by a thread of the connection. A failed write
+    cancels the requests of the connection'''
+
+    def __init__(self, wfile, service):
+        self.wfile = wfile
+        self.service = service
+        self.outbox = Queue.Queue()
+        self.lock = threading.Condition()
+        self.outstanding = 0            #responses expected, not yet written
+        self.broken = False             #a write has failed
+        self.writer = threading.Thread(target=self._write)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def expect(self):
+        '''Count a response to come'''
+        with self.lock:
+            self.outstanding += 1
+
+    def respond(self, response):
+        self.outbox.put(response)
+
+    def wait(self):
+        '''Wait until every expected response is written, or a write
+        fails'''
+        with self.lock:
+            while self.outstanding > 0 and not self.broken:
+                self.lock.wait()
+
+    def close(self):
+        '''Cancel the requests not yet answered, and stop the writer'''
+        self.service.cancel(self)
+        self.outbox.put(None)
+        self.writer.join()
+
+    def _write(self):
+        while True:
+            response = self.outbox.get()
+            if response is None:
+                return
+            if not self.broken:
+                try:
+                    self.wfile.write(json.dumps(response) + "\n")
+                    self.wfile.flush()
+                except (IOError, ValueError):
+                    #the client is gone (ValueError: the file is closed)
+                    self.service.cancel(self)
+                    with self.lock:
+                        self.broken = True
+                        self.lock.notify_all()
+                    continue
+            with self.lock:
+                self.outstanding -= 1
+                self.lock.notify_all()
+
+class _Handler(SocketServer.StreamRequestHandler):
+    '''Read the requests of a connection, and hand their responses to its
+    writer'''
+
+    def handle(self):
+        service = self.server.service
+        connection = _Connection(self.wfile, service)
+        try:
+            for line in iter(self.rfile.readline, ''):
+                if connection.broken:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                connection.expect()
+                try:
+                    payload = json.loads(line)
+                    if not isinstance(payload, dict):
+                        raise ValueError("a request is a JSON object")
+                except ValueError as e:
+                    connection.respond({'id': None, 'error': "invalid request: {}".format(e)})
+                    continue
+                if payload.get('op') == 'metrics':
+                    metrics = service.metrics()
+                    metrics['id'] = payload.get('id')
+                    connection.respond(metrics)
+                else:
+                    service.submit(payload, connection.respond, connection)
+
+            #the client has finished sending: wait for its last responses
+            connection.wait()
+        except socket.error:
+            #e.g., the connection was reset
+            pass
+        finally:
+            connection.close()
+
+    def finish(self):
+        try:
+            SocketServer.StreamRequestHandler.finish(self)
+        except socket.error:
+            #the client is gone: nothing left to flush to
+            pass
+
+class TCPSolverServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, service):
+        SocketServer.TCPServer.__init__(self, address, _Handler)
+        self.service = service
+
+class UnixSolverServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, service):
+        SocketServer.UnixStreamServer.__init__(self, path, _Handler)
+        self.service = service
+
+#A client
+
+class Client(object):
+    '''A connection to a server, at address: a (host, port) pair for TCP
+    or a path for a Unix socket'''
+
+    def __init__(self, address):
+        if isinstance(address, basestring):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.connect(address)
+        self.rfile = self.socket.makefile('r')
+        self.next_id = 0
+
+    def send(self, payload):
+        '''Send a request, numbering it if it has no id. Return its id'''
+        if 'id' not in payload:
+            payload = dict(payload, id=self.next_id)
+            self.next_id += 1
+        self.socket.sendall(json.dumps(payload) + "\n")
+        return payload['id']
+
+    def receive(self):
+        '''Return the next response'''
+        line = self.rfile.readline()
+        if not line:
+            raise IOError("connection closed by the server")
+        return json.loads(line)
+
+    def request(self, payload):
+        '''Send a request and return its response (no other request may
+        be outstanding)'''
+        self.send(payload)
+        return self.receive()
+
+    def close(self):
+        self.rfile.close()
+        self.socket.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sudoku solving service")
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument('--tcp', help="HOST:PORT to listen on (or connect to)")
+    where.add_argument('--unix', help="path of the Unix socket")
+    parser.add_argument('--processes', '-j', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--batch-delay', type=float, default=0.002)
+    parser.add_argument('--max-pending', type=int, default=1024)
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--client', metavar='FILE',
+                        help="send the boards of FILE (- for standard input) to the server")
+    parser.add_argument('--op', choices=['gac', 'solve'], default='gac')
+    parser.add_argument('--model', type=int, choices=[1, 2], default=1)
+    options = parser.parse_args(argv)
+
+    if options.tcp:
+        host, port = options.tcp.rsplit(':', 1)
+        address = (host, int(port))
+    else:
+        address = options.unix
+
+    if options.client:
+        infile = sys.stdin if options.client == '-' else open(options.client)
+        client = Client(address)
+        sent = 0
+        for board in read_boards(infile):
+            client.send({'board': format_board(board), 'op': options.op, 'model': options.model})
+            sent += 1
+        for k in range(sent):
+            sys.stdout.write(json.dumps(client.receive()) + "\n")
+        sys.stdout.write(json.dumps(client.request({'op': 'metrics'})) + "\n")
+        client.close()
+        return
+
+    service = SolverService(options.processes, options.batch_size, options.batch_delay,
+                            options.max_pending, options.timeout)
+    if options.tcp:
+        server = TCPSolverServer(address, service)
+    else:
+        server = UnixSolverServer(address, service)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+'''Precomputed permutation tables for table-based all-different
+   constraints (requires numpy).
+
+   An all-different constraint over a unit of 9 cells can be given as a
+   table constraint whose satisfying tuples are the permutations of the
+   values that agree with the pre-set cells of the unit (found by
+   scanning every permutation for each unit, in the original model 2).
+   Here the table of the 9! permutations, and for each
+   position and value the indexes of the permutations having that value
+   at that position, are computed once and stored in a binary file:
+
+      header    8 bytes 'ALLDIFF\\0', then the format version and the
+                number of values (unsigned 32 bit integers)
+      perms     the permutations, in lexicographic order, as an
+                (count, size) array of int8 values (1 to size)
+      index     index[p, v - 1] is the sorted array of the count/size
+                numbers of the permutations with value v at position p,
+                as an (size, size, count/size) array of int32
+
+   The file is built the first time it is needed (or again if its version
+   does not match), in the directory given by the environment variable
+   SUDOKU_CSP_CACHE or else in the sudoku_csp directory of the user's
+   cache directory ($XDG_CACHE_HOME, by default ~/.cache), and then
+   memory-mapped read-only, so the operating
+   system shares its pages between all the processes using it (e.g. the
+   workers of sudoku_batch). The permutations agreeing with the pre-set
+   cells of a unit are found by intersecting the index arrays of those
+   cells, without scanning the table. A unit without pre-set cells uses
+   the whole table, whose supports are computed once per process.
+
+   sudoku_enforce_gac_model_2_table gives the same domains as
+   sudoku_enforce_gac_model_2, with a CompactTableConstraint over these
+   tuples for each unit instead of an AllDiffConstraint.
+
+   The table has size! rows, so it is only built for units of at most
+   MAX_SIZE values (9x9 boards); larger sizes raise ValueError.
+'''
+
+from sudoku_csp import *
+import binascii
+import itertools
+import math
+import os
+import struct
+
+import numpy as np
+
+
+MAGIC = 'ALLDIFF\0'
+VERSION = 1
+HEADER = struct.Struct('<8sII')
+
+#9! permutations take 3.3 MB (with their int32 index, 16.3 MB); 10!
+#would take 36 MB (181 MB)
+MAX_SIZE = 9
+
+
+def default_directory():
+    '''Return the directory of the table files when none is given'''
+
+    directory = os.environ.get('SUDOKU_CSP_CACHE')
+    if directory:
+        return directory
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'sudoku_csp')
+
+
+class PermutationTables(object):
+    '''The permutation table and support indexes for units of size values,
+    memory-mapped from the file at path'''
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            magic, version, size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} permutation table".format(path, VERSION))
+        count = math.factorial(size)
+        self.path = path
+        self.size = size
+        #plain arrays over the mapping (indexing a memmap is slower)
+        self.perms = np.memmap(path, dtype=np.int8, mode='r',
+                               offset=HEADER.size, shape=(count, size)).view(np.ndarray)
+        self.index = np.memmap(path, dtype=np.int32, mode='r',
+                               offset=HEADER.size + count * size,
+                               shape=(size, size, count // size)).view(np.ndarray)
+        self._all_supports = None
+
+    def matching(self, fixed):
+        '''Return the sorted array of the numbers of the permutations with
+        value v at position p for each (p, v) in fixed, or None (every
+        permutation) if fixed is empty'''
+
+        if not fixed:
+            return None
+        #the index arrays all have count/size numbers: intersect the
+        #result so far (the smaller array) with each of them
+        (p, v), rest = fixed[0], fixed[1:]
+        result = self.index[p, v - 1]
+        for p, v in rest:
+            result = _intersect(result, self.index[p, v - 1])
+        return result
+
+    def supports(self, matches):
+        '''Return supports[p][v - 1], the bitset of the permutations with
+        value v at position p: bit k is for the k-th permutation numbered
+        in matches (as returned by matching)'''
+
+        if matches is not None:
+            return _bitsets(self.perms[matches], self.size)
+        if self._all_supports is None:
+            self._all_supports = _bitsets(self.perms, self.size)
+        return self._all_supports
+
+def _intersect(small, large):
+    '''Return the numbers of the sorted array small found in the sorted
+    array large'''
+
+    if len(small) == 0:
+        return small
+    positions = np.minimum(np.searchsorted(large, small), len(large) - 1)
+    return small[large[positions] == small]
+
+def _bitsets(rows, size):
+    '''Return bits[p][v - 1], the integer whose bit k is set iff
+    rows[k, p] == v'''
+
+    count = len(rows)
+    if count == 0:
+        return [[0] * size for p in range(size)]
+    #packbits puts the first bit highest: pack the rows in reverse order,
+    #after the padding to a whole number of bytes
+    padding = (-count) % 8
+    masks = np.zeros((size, size, padding + count), dtype=bool)
+    masks[np.arange(size)[:, None], rows[::-1].T - 1, np.arange(padding, padding + count)] = True
+    packed = np.packbits(masks, axis=2)
+    return [[int(binascii.hexlify(packed[p, v].tobytes()), 16) for v in range(size)]
+            for p in range(size)]
+
+def build_tables(path, size=9):
+    '''Write the permutation tables for units of size values to path'''
+
+    _check_size(size)
+    count = math.factorial(size)
+    perms = np.array(list(itertools.permutations(range(1, size + 1))), dtype=np.int8)
+    index = np.empty((size, size, count // size), dtype=np.int32)
+    for p in range(size):
+        for v in range(size):
+            index[p, v] = np.nonzero(perms[:, p] == v + 1)[0]
+
+    #write to a temporary file first, so that a process never maps a
+    #partly written table
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, size))
+        f.write(perms.tobytes())
+        f.write(index.tobytes())
+    os.rename(tmp, path)
+
+_loaded = {}
+
+def load_tables(size=9, directory=None):
+    '''Return the PermutationTables for units of size values, from the
+    file alldiff<size>.tbl in directory (by default, default_directory()),
+    building it (and the directory) if needed. Tables are loaded once per
+    process'''
+
+    _check_size(size)
+    if directory is None:
+        directory = default_directory()
+    path = os.path.join(directory, 'alldiff{}.tbl'.format(size))
+    if path not in _loaded:
+        try:
+            tables = PermutationTables(path)
+        except (IOError, ValueError):
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    #created meanwhile by another process
+                    if not os.path.isdir(directory):
+                        raise
+            build_tables(path, size)
+            tables = PermutationTables(path)
+        _loaded[path] = tables
+    return _loaded[path]
+
+def _check_size(size):
+    if size > MAX_SIZE:
+        raise ValueError("permutation tables are limited to units of {} values, not {}".format(
+            MAX_SIZE, size))
+
+def alldif_table_constraint(name, scope, tables):
+    '''Return a CompactTableConstraint over the variables of scope (a unit)
+    whose tuples are the permutations agreeing with the variables that
+    have a single value in their current domain'''
+
+    fixed = [(p, V.cur_domain()[0]) for p, V in enumerate(scope) if V.cur_domain_size() == 1]
+    matches = tables.matching(fixed)
+    supports = tables.supports(matches)
+
+    C = CompactTableConstraint(name, scope)
+    C.sat_tuples = tables.perms if matches is None else tables.perms[matches]
+    for i, V in enumerate(scope):
+        for j, value in enumerate(V.domain()):
+            C.supports[i][j] = supports[i][value - 1]
+    return C
+
+def sudoku_model_2_table(initial_sudoku_board, tables=None):
+    '''Return (variables, constraints) for the board, as for
+    sudoku_model_2 but with a table constraint for each unit'''
+
+    n = box_size(initial_sudoku_board)
+    _check_size(n * n)
+    if tables is None:
+        tables = load_tables(n * n)
+    variables = make_variables(initial_sudoku_board)
+
+    units = [("ALLDIFF-ROW: R", variables),
+             ("ALLDIFF-COL: C", group_cols(variables)),
+             ("ALLDIFF-BOX: B", group_boxes(variables))]
+    constraints = []
+    for prefix, groups in units:
+        for k, unit in enumerate(groups):
+            constraints.append(alldif_table_constraint(prefix + str(k), unit, tables))
+    return variables, constraints
+
+def sudoku_enforce_gac_model_2_table(initial_sudoku_board, budget=None):
+    '''Return the domains of sudoku_enforce_gac_model_2 for the board,
+    computed with the precomputed permutation tables (only partly pruned
+    if the budget, if given, runs out)'''
+
+    variables, constraints = sudoku_model_2_table(initial_sudoku_board)
+    enforce_gac(constraints, budget=budget)
+    return cur_domains(variables)
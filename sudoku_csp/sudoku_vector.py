@@ -0,0 +1,201 @@
+'''Vectorized GAC over batches of sudoku boards (requires numpy).
+
+   A batch of N boards is represented as a boolean candidate tensor of
+   shape (N, 81, 9): cand[n, c, v] is True iff value v+1 is in the current
+   domain of cell c (cells numbered row by row) of board n. Instead of
+   Variable and Constraint objects, the pruning of model 1 and model 2 is
+   applied to the whole batch with array operations, until no board
+   changes any more.
+
+   MODEL 1: GAC on a binary not-equal constraint removes a value from a
+   cell iff a peer of the cell (same row, column or box) has that value
+   as its only candidate.
+
+   MODEL 2: GAC on an all-different constraint over a unit (row, column or
+   box) is characterized by Hall sets. For every set of values M, let
+   S be the cells of the unit whose domain is a subset of M. If
+   |S| > |M| the constraint cannot be satisfied; if |S| == |M| the
+   values of M are removed from the cells of the unit outside S. The
+   sizes of S for all 512 sets of values (9-bit masks) of the units
+   are counted at once: the number of cells with each domain, summed
+   over the subsets of each mask (a subset-sum transform, one array
+   operation per value). A cell outside a Hall set M has a value b not
+   in M, so the values removed from a cell are the union, over the
+   values b of its domain, of the Hall sets without b. Removing these
+   values makes the unit GAC, so a sweep only revises the units with a
+   cell changed since their last revision: the rows, then the columns,
+   then the boxes, each group with the prunings of the previous ones.
+
+   A board whose constraints cannot be satisfied (a domain wipe out, or a
+   unit with too few values) is marked as failed and is not propagated
+   any further. For the other boards the resulting domains are those of
+   sudoku_enforce_gac_model_1/_2; for a failed board only the failure
+   itself is meaningful, as the domains at the point of failure depend
+   on the order in which the constraints are revised.
+
+   Given a cspbase.Budget, its deadline and cancellation are checked
+   between sweeps over the batch (its revision and node limits do not
+   apply), and the boards are left partly pruned when it runs out.
+'''
+
+import numpy as np
+
+
+def _units():
+    '''Return the 27 units (rows, then columns, then boxes) as a (27, 9)
+    array of cell numbers'''
+    rows = [[9 * i + j for j in range(9)] for i in range(9)]
+    cols = [[9 * i + j for i in range(9)] for j in range(9)]
+    boxes = [[9 * (3 * (b // 3) + k // 3) + 3 * (b % 3) + k % 3 for k in range(9)]
+             for b in range(9)]
+    return np.array(rows + cols + boxes)
+
+UNITS = _units()
+
+#PEERS[c, p] is 1 iff cells c and p are distinct and share a unit
+PEERS = np.zeros((81, 81), dtype=np.int16)
+for _unit in UNITS:
+    PEERS[np.ix_(_unit, _unit)] = 1
+np.fill_diagonal(PEERS, 0)
+
+#bit of each value in a 9-bit domain mask
+POW2 = (1 << np.arange(9)).astype(np.int16)
+
+#POPCOUNT[m] is the number of bits set in the 9-bit mask m
+POPCOUNT = np.array([bin(m).count('1') for m in range(512)], dtype=np.int8)
+
+MASKS = np.arange(512, dtype=np.int16)
+
+
+def candidates(boards):
+    '''Given a list of N boards (each a list of 9 lists, as for
+    sudoku_enforce_gac_model_1) or an array of shape (N, 81) or
+    (N, 9, 9), return their (N, 81, 9) candidate tensor'''
+
+    values = np.asarray(boards, dtype=np.int8)
+    if values.size % 81 != 0 or values.shape[-1] not in (9, 81):
+        raise ValueError("the numpy engine only handles 9x9 boards")
+    values = values.reshape(-1, 81)
+    cand = np.ones(values.shape + (9,), dtype=bool)
+    n, c = np.nonzero(values)
+    cand[n, c, :] = False
+    cand[n, c, values[n, c] - 1] = True
+    return cand
+
+def domains(cand):
+    '''Given the (81, 9) candidates of one board, return its domains in
+    the format of sudoku_enforce_gac_model_1'''
+
+    return [[[v + 1 for v in range(9) if cand[9 * i + j, v]] for j in range(9)]
+            for i in range(9)]
+
+def enforce_gac_batch(boards, model=1, block=128, budget=None):
+    '''Enforce GAC with the constraints of model 1 or 2 on a batch of
+    boards (see candidates for the accepted formats). Return a pair
+    (cand, ok): the pruned (N, 81, 9) candidate tensor, and a boolean
+    array of shape (N,) that is False for the boards on which a failure
+    was detected. The boards are processed block boards at a time to
+    bound memory use. If the budget, if given, runs out, the boards are
+    only partly pruned (and budget.exhausted is True)'''
+
+    if model == 1:
+        revise = _revise_model_1
+    elif model == 2:
+        revise = _revise_model_2
+    else:
+        raise ValueError("unknown model {}".format(model))
+
+    cand = candidates(boards)
+    ok = np.ones(len(cand), dtype=bool)
+    for start in range(0, len(cand), block):
+        part = slice(start, start + block)
+        cand[part], ok[part] = _propagate(cand[part], revise, budget)
+    return cand, ok
+
+def _propagate(cand, revise, budget=None):
+    '''Apply revise to the boards of cand that are still changing, until
+    a fixpoint is reached (or the budget runs out)'''
+
+    ok = cand.any(axis=2).all(axis=1)
+    active = np.nonzero(ok)[0]
+    #the cells of each board changed since the last revision
+    changed = np.ones(cand.shape[:2], dtype=bool)
+    while len(active) > 0:
+        if budget is not None and budget.check():
+            break
+        new, feasible = revise(cand[active], changed[active])
+        feasible &= new.any(axis=2).all(axis=1)
+        diff = (new != cand[active]).any(axis=2)
+        cand[active] = new
+        ok[active] = feasible
+        changed[active] = diff
+        active = active[feasible & diff.any(axis=1)]
+    return cand, ok
+
+def _revise_model_1(cand, changed):
+    '''Remove from each cell the values that are the single candidate of
+    one of its peers'''
+
+    singles = cand & (cand.sum(axis=2) == 1)[:, :, None]
+    hits = np.matmul(PEERS, singles.astype(np.int16))
+    return cand & (hits == 0), np.ones(len(cand), dtype=bool)
+
+def _revise_model_2(cand, changed):
+    '''Remove from each cell the values of the Hall sets of its units that
+    do not contain it. Also return which boards have no unit with too few
+    values. Removing these values makes a unit GAC, so only the units with
+    a changed cell (see _propagate) are revised'''
+
+    bits = (cand * POW2).sum(axis=2).astype(np.int16)   #(n, 81) domain masks
+    changed = changed.copy()
+    feasible = np.ones(len(cand), dtype=bool)
+    #the rows, then the columns, then the boxes, each group revised with
+    #the prunings of the previous ones (the units of a group have distinct
+    #cells, so they are revised at once)
+    for group in (UNITS[:9], UNITS[9:18], UNITS[18:]):
+        board, unit = np.nonzero(changed[:, group].any(axis=2))
+        cells = group[unit]
+        unit_bits = bits[board[:, None], cells]         #(k, 9), k units revised
+        remove, failed = _hall_prunings(unit_bits)
+        feasible[board[failed]] = False
+        bits[board[:, None], cells] = unit_bits & ~remove
+        changed[board[:, None], cells] |= (unit_bits & remove) != 0
+    return (bits[:, :, None] & POW2) != 0, feasible
+
+def _hall_prunings(unit_bits):
+    '''Given the (k, 9) domain masks of the cells of k units, return the
+    (k, 9) masks of the values to remove from the cells, and which units
+    have too few values'''
+
+    k = len(unit_bits)
+
+    #inside[m, u] is the number of cells of unit u whose domain is a
+    #subset of m: the number of cells with domain m, summed over the
+    #subsets of m one value at a time
+    inside = np.zeros((512, k), dtype=np.int8)
+    columns = np.arange(k)
+    for c in range(9):
+        inside[unit_bits[:, c], columns] += 1
+    _subset_transform(inside, np.add)
+
+    failed = (inside > POPCOUNT[:, None]).any(axis=0)
+    hall = (inside == POPCOUNT[:, None]) * MASKS[:, None]
+
+    #without[b, u] is the union of the Hall sets of unit u without value
+    #b: of those that are subsets of every value but b
+    _subset_transform(hall, np.bitwise_or)
+    without = hall[511 ^ POW2]
+
+    #the cells with value b lose the Hall sets without b
+    remove = np.zeros((k, 9), dtype=np.int16)
+    for b in range(9):
+        remove |= without[b][:, None] & -((unit_bits >> b) & 1)
+    return remove, failed
+
+def _subset_transform(table, combine):
+    '''Replace table[m] (for the 512 masks m, on the first axis) by
+    table[m] combined with table[s] for every subset s of m'''
+
+    for b in range(9):
+        halves = table.reshape((512 >> (b + 1), 2, 1 << b) + table.shape[1:])
+        combine(halves[:, 1], halves[:, 0], out=halves[:, 1])
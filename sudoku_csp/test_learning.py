@@ -0,0 +1,85 @@
+'''Checks of search with nogood learning (sudoku_learning): it agrees
+with solve on boards with solutions and on boards without, with and
+without restarts, and stops when its budget runs out.
+
+   python test_learning.py
+'''
+
+from sudoku_learning import *
+from sudoku_batch import parse_board, format_board
+from test_boards import board6
+
+#a board needing search
+HARD = "800000000003600000070090200050007000000045700000100030001000068008500010090000400"
+
+
+def satisfiable():
+    '''Return boards with one solution, and one with several'''
+    several = [row[:] for row in board6]
+    clues = [(i, j) for i in range(9) for j in range(9) if board6[i][j]]
+    for i, j in clues[:2]:
+        several[i][j] = 0
+    return [parse_board(HARD), board6, several]
+
+def unsatisfiable():
+    '''Return boards without a solution: two pre-set cells in conflict,
+    and boards where a value of the solution is replaced by another
+    value of the cell's initial domain, so that the failure is only
+    found by search'''
+    conflict = parse_board(HARD)
+    conflict[0][8] = 8
+    boards = [conflict]
+    for board in (parse_board(HARD), board6):
+        solution, stats = solve(board)
+        domains = sudoku_enforce_gac_model_2(board)
+        for i in range(9):
+            for j in range(9):
+                others = [v for v in domains[i][j] if v != solution[i][j]]
+                if board[i][j] == 0 and others and len(boards) < 5:
+                    wrong = [row[:] for row in board]
+                    wrong[i][j] = others[0]
+                    boards.append(wrong)
+    return boards
+
+def is_solution(board, solution):
+    if any(board[i][j] not in (0, solution[i][j]) for i in range(9) for j in range(9)):
+        return False
+    return count_solutions(solution) == 1 and all(0 not in row for row in solution)
+
+def test_satisfiable():
+    for board in satisfiable():
+        for restarts in (True, False):
+            solution, stats = solve_learning(board, restarts)
+            assert solution is not None, format_board(board)
+            assert is_solution(board, solution), format_board(board)
+            assert not stats.get('incomplete')
+
+def test_unsatisfiable():
+    boards = unsatisfiable()
+    assert len(boards) > 1
+    for board in boards:
+        assert solve(board)[0] is None and count_solutions(board, 1) == 0
+        for restarts in (True, False):
+            solution, stats = solve_learning(board, restarts)
+            assert solution is None and not stats.get('incomplete'), format_board(board)
+
+def test_budget():
+    solution, stats = solve_learning(parse_board(HARD), budget=Budget(nodes=5))
+    assert solution is None and stats.get('incomplete'), stats
+    #an easy board within the budget
+    solution, stats = solve_learning(board6, budget=Budget(nodes=1000))
+    assert solution is not None and not stats.get('incomplete'), stats
+
+def test_trail_detached():
+    #the compiled model is shared with the other searches
+    solve_learning(board6)
+    compiled = compiled_model(1, 3)
+    assert all(V.trail is None for row in compiled.variables for V in row)
+
+def run_tests():
+    for test in (test_satisfiable, test_unsatisfiable, test_budget, test_trail_detached):
+        test()
+        print "{} ok".format(test.__name__)
+
+if __name__ == '__main__':
+    run_tests()
@@ -0,0 +1,99 @@
+'''Checks of portfolio solving (sudoku_portfolio): counts agree with
+count_solutions, solutions are solutions of the board, and the race
+ends (with an incomplete result) when its budget runs out or its
+processes are killed.
+
+   python test_portfolio.py
+'''
+
+from sudoku_portfolio import *
+import os
+import signal
+import threading
+import time
+
+from test_boards import board6
+
+#a board needing search
+HARD = "800000000003600000070090200050007000000045700000100030001000068008500010090000400"
+
+
+def boards():
+    '''Return (board, limit) pairs: boards with one solution, none,
+    1447 solutions, and many more (counted up to a limit)'''
+    clues = [(i, j) for i in range(9) for j in range(9) if board6[i][j]]
+    several = [row[:] for row in board6]
+    for i, j in clues[:2]:
+        several[i][j] = 0
+    many = [row[:] for row in board6]
+    for i, j in clues[:8]:
+        many[i][j] = 0
+    conflict = parse_board(HARD)
+    conflict[0][8] = 8
+    return [(parse_board(HARD), None), (board6, None), (conflict, None),
+            (several, None), (several, 10), (many, 100)]
+
+def test_count_agrees():
+    configs = configurations(4)
+    for board, limit in boards():
+        stats = {}
+        count = count_portfolio(board, limit, configs, stats=stats)
+        assert count == count_solutions(board, limit), (format_board(board), limit, count)
+        assert not stats.get('incomplete')
+
+def test_solutions():
+    configs = configurations(5)
+    for board, limit in boards():
+        solution, stats = solve_portfolio(board, configs)
+        if count_solutions(board, 1) == 0:
+            assert solution is None and not stats.get('incomplete'), stats
+            continue
+        assert solution is not None, format_board(board)
+        assert all(board[i][j] in (0, solution[i][j]) for i in range(9) for j in range(9))
+        assert count_solutions(solution) == 1
+
+def test_deadline():
+    empty = [[0] * 9 for i in range(9)]
+    stats = {}
+    start = time.time()
+    budget = Budget(seconds=0.5)
+    count = count_portfolio(empty, None, configurations(2), budget, stats)
+    assert stats.get('incomplete') and count > 0 and budget.exhausted, stats
+    assert time.time() - start < 0.5 + GRACE + 1.0
+
+def test_budget():
+    #a node limit is given to every process
+    budget = Budget(nodes=5)
+    solution, stats = solve_portfolio(parse_board(HARD), configurations(3), budget)
+    assert solution is None and stats.get('incomplete') and budget.exhausted, stats
+    #cancelled from another thread
+    budget = Budget()
+    timer = threading.Timer(0.5, budget.cancel)
+    timer.start()
+    start = time.time()
+    empty = [[0] * 9 for i in range(9)]
+    stats = {}
+    count_portfolio(empty, None, configurations(2), budget, stats)
+    assert stats.get('incomplete') and budget.exhausted, stats
+    assert time.time() - start < 0.5 + 1.0
+
+def test_killed_workers():
+    def kill():
+        time.sleep(0.5)
+        for child in multiprocessing.active_children():
+            os.kill(child.pid, signal.SIGKILL)
+    thread = threading.Thread(target=kill)
+    thread.start()
+    empty = [[0] * 9 for i in range(9)]
+    stats = {}
+    count = count_portfolio(empty, None, configurations(2), None, stats)
+    thread.join()
+    assert stats.get('incomplete') and count == 0, stats
+
+def run_tests():
+    for test in (test_count_agrees, test_solutions, test_deadline, test_budget, test_killed_workers):
+        test()
+        print "{} ok".format(test.__name__)
+
+if __name__ == '__main__':
+    run_tests()
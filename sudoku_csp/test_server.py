@@ -0,0 +1,129 @@
+'''Checks of the solving service (sudoku_server): a client that resets
+its connection with requests pending must not stop the service from
+answering other clients, nor must workers killed in the middle of a
+batch, and malformed timeouts are rejected as invalid requests.
+
+   python test_server.py
+'''
+
+from sudoku_server import *
+import os
+import signal
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+from test_boards import board6
+
+#a board needing search with model 1
+HARD = "800000000003600000070090200050007000000045700000100030001000068008500010090000400"
+
+
+def start_server(**options):
+    '''Return (server, service, address) of a server on a temporary Unix
+    socket, serving from a thread'''
+    address = os.path.join(tempfile.mkdtemp(), 'sudoku.sock')
+    service = SolverService(**options)
+    server = UnixSolverServer(address, service)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, service, address
+
+def stop_server(server, service, address):
+    server.shutdown()
+    server.server_close()
+    service.close()
+    os.remove(address)
+    os.rmdir(os.path.dirname(address))
+
+def reset(client):
+    '''Close the connection of client with a reset (RST), as a crashed
+    client would'''
+    client.socket.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    client.close()
+
+def test_disconnect_mid_batch():
+    server, service, address = start_server(processes=2, batch_size=8, timeout=5.0)
+    try:
+        gone = Client(address)
+        for k in range(256):
+            gone.send({'board': HARD, 'op': 'solve', 'model': 1})
+        #reset while most requests are pending, some answered
+        time.sleep(0.1)
+        reset(gone)
+
+        other = Client(address)
+        other.socket.settimeout(15)
+        response = other.request({'board': format_board(board6), 'op': 'solve', 'model': 2,
+                                  'timeout': 30})
+        assert response.get('solution') is not None, response
+
+        #the requests of the closed connection are dropped or answered
+        deadline = time.time() + 15
+        while time.time() < deadline:
+            metrics = other.request({'op': 'metrics'})
+            if metrics['queued'] == 0 and metrics['running'] == 0:
+                break
+            time.sleep(0.2)
+        assert metrics['queued'] == 0 and metrics['running'] == 0, metrics
+        other.close()
+    finally:
+        stop_server(server, service, address)
+
+def test_killed_worker():
+    #more kills than the batches allowed in flight (2 per worker)
+    server, service, address = start_server(processes=1, timeout=5.0)
+    try:
+        client = Client(address)
+        client.socket.settimeout(30)
+        for k in range(3):
+            client.send({'board': HARD, 'op': 'solve', 'model': 1, 'timeout': 1.0})
+            time.sleep(0.3)
+            for worker in service.pool._pool:
+                os.kill(worker.pid, signal.SIGKILL)
+            response = client.receive()
+            assert response.get('error') == "timeout" or response.get('incomplete'), response
+        response = client.request({'board': format_board(board6), 'op': 'solve', 'model': 2})
+        assert response.get('solution') is not None, response
+        metrics = client.request({'op': 'metrics'})
+        assert metrics['restarts'] >= 1 and metrics['running_batches'] == 0, metrics
+        client.close()
+    finally:
+        stop_server(server, service, address)
+
+def test_invalid_timeout():
+    server, service, address = start_server(processes=1)
+    try:
+        client = Client(address)
+        client.socket.settimeout(15)
+        for timeout in ("soon", None, 0, -1):
+            response = client.request({'id': 1, 'board': HARD, 'timeout': timeout})
+            assert response['error'].startswith("invalid request"), response
+        #the connection is still served
+        response = client.request({'id': 2, 'board': HARD, 'timeout': 5})
+        assert 'domains' in response, response
+        client.close()
+    finally:
+        stop_server(server, service, address)
+
+def test_timeout():
+    server, service, address = start_server(processes=1)
+    try:
+        client = Client(address)
+        client.socket.settimeout(15)
+        response = client.request({'board': HARD, 'op': 'solve', 'model': 1, 'timeout': 0.01})
+        assert response.get('incomplete') or response.get('error') == "timeout", response
+        client.close()
+    finally:
+        stop_server(server, service, address)
+
+def run_tests():
+    for test in (test_disconnect_mid_batch, test_killed_worker, test_invalid_timeout, test_timeout):
+        test()
+        print "{} ok".format(test.__name__)
+
+if __name__ == '__main__':
+    run_tests()